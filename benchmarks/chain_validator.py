@@ -0,0 +1,72 @@
+"""
+Micro-benchmark for ChainValidator on large offline-sync batches.
+
+Every task in the snapshot is submitted with its full chain:
+task (InProgress) -> subtask (InProgress) -> subtask (Completed) -> ... -> task (Completed).
+
+    python -m benchmarks.chain_validator
+"""
+import datetime
+import gc
+import time
+
+from core.model.task.db import DBAppTask, DBSubTask
+from core.model.task.enums import StatusEnum
+from core.model.task.requests import UpdTaskData
+from core.service.task.validator import ChainValidator
+
+SUBTASKS_PER_TASK = 6
+
+
+def generate_snapshot(task_count: int) -> tuple[list[DBAppTask], list[UpdTaskData]]:
+    start = datetime.datetime(2024, 1, 1)
+    tasks, events = [], []
+    next_id = task_count + 1
+
+    for task_id in range(1, task_count + 1):
+        dt = start + datetime.timedelta(days=task_id)
+        subtasks = []
+        for idx in range(SUBTASKS_PER_TASK):
+            sdt = dt + datetime.timedelta(hours=idx)
+            subtasks.append(DBSubTask(id=next_id, start_pln=sdt, end_pln=sdt, start_fact=None, end_fact=None,
+                                      status=StatusEnum.NOT_DEFINED, task_type="Mst_In", text="subtask"))
+            next_id += 1
+        tasks.append(DBAppTask(id=task_id, profile_id=31, start_pln=dt, end_pln=dt, start_fact=None, end_fact=None,
+                               status=StatusEnum.NOT_DEFINED, task_type="MovMarsh", text="task",
+                               subtasks=list(reversed(subtasks))))
+
+        events.append(UpdTaskData(task_id=task_id, dt=dt, status=StatusEnum.IN_PROGRESS))
+        for idx, subtask in enumerate(subtasks):
+            events.append(UpdTaskData(task_id=subtask.id, dt=dt + datetime.timedelta(hours=idx),
+                                      status=StatusEnum.IN_PROGRESS))
+            events.append(UpdTaskData(task_id=subtask.id, dt=dt + datetime.timedelta(hours=idx + 1),
+                                      status=StatusEnum.COMPLETED))
+        events.append(UpdTaskData(task_id=task_id, dt=dt + datetime.timedelta(hours=SUBTASKS_PER_TASK),
+                                  status=StatusEnum.COMPLETED))
+
+    return tasks, events
+
+
+def measure(tasks: list[DBAppTask], events: list[UpdTaskData], repeat: int = 5) -> float:
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ChainValidator(tasks).validate(events)
+            best = min(best, time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    print(f"{'tasks':>8} {'events':>8} {'total, ms':>12} {'per event, us':>14}")
+    for task_count in (50, 100, 200, 400, 800):
+        tasks, events = generate_snapshot(task_count)
+        elapsed = measure(tasks, events)
+        print(f"{task_count:>8} {len(events):>8} {elapsed * 1000:>12.2f} {elapsed / len(events) * 1_000_000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
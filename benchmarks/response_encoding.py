@@ -0,0 +1,86 @@
+"""
+Benchmark for encoding the GET /api/v1/tasks response.
+
+Compares FastAPI's default path (response_model validation + serialization, rendered by JSONResponse) with the
+same path rendered by ORJSONResponse, with dumping through the precompiled TypeAdapter and with the raw event data
+pass-through used by the handlers. Every path gets a fresh tree as served from the snapshot cache, which holds the
+event data as stored text only, so no path reuses parsed event data.
+
+    python -m benchmarks.response_encoding
+"""
+import asyncio
+import gc
+import json
+import time
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from benchmarks.task_tree import generate_rows, LST_ROWS
+from core.database.db import serializer, deserializer
+from core.helpers.serialization import dump_json, tasks_adapter
+from core.model.task.db import DBAppTask
+from core.storage import task_storage, dictionary_storage
+
+TASK_COUNT = 500
+
+response_field = create_response_field(name="Response_get_tasks", type_=list[DBAppTask], mode="serialization")
+
+
+def default_path(tasks: list[DBAppTask]) -> bytes:
+    content = asyncio.run(serialize_response(field=response_field, response_content=tasks))
+    return JSONResponse(content).body
+
+
+def orjson_path(tasks: list[DBAppTask]) -> bytes:
+    content = asyncio.run(serialize_response(field=response_field, response_content=tasks))
+    return ORJSONResponse(content).body
+
+
+def adapter_path(tasks: list[DBAppTask]) -> bytes:
+    return tasks_adapter.dump_json(tasks, by_alias=True)
+
+
+def passthrough_path(tasks: list[DBAppTask]) -> bytes:
+    return dump_json(tasks_adapter, tasks)
+
+
+def build_tree() -> list[DBAppTask]:
+    tasks = task_storage.build_task_tree(*task_storage.split_joined_rows(generate_rows(TASK_COUNT)))
+    return deserializer(serializer(tasks))
+
+
+def measure(encode, repeat: int = 10) -> float:
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            tasks = build_tree()
+            started = time.perf_counter()
+            encode(tasks)
+            best = min(best, time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    dictionary_storage.populate(LST_ROWS, [])
+    expected = json.loads(default_path(build_tree()))
+    assert json.loads(orjson_path(build_tree())) == expected
+    assert json.loads(adapter_path(build_tree())) == expected
+    assert json.loads(passthrough_path(build_tree())) == expected
+
+    results = [(name, measure(encode)) for name, encode in (("response_model + JSONResponse", default_path),
+                                                             ("response_model + ORJSONResponse", orjson_path),
+                                                             ("TypeAdapter.dump_json", adapter_path),
+                                                             ("raw event data pass-through", passthrough_path))]
+    print(f"{TASK_COUNT} tasks, {len(passthrough_path(build_tree())) / 1024:.0f} KiB")
+    print(f"{'path':>36} {'ms':>8} {'speedup':>8}")
+    for name, elapsed in results:
+        print(f"{name:>36} {elapsed * 1000:>8.2f} {results[0][1] / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
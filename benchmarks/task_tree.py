@@ -0,0 +1,78 @@
+"""
+Benchmark for TaskStorage.build_task_tree.
+
+Builds synthetic FETCH_TASKS_WITH_SUBTASKS result sets of growing size and prints the cost per joined row,
+which should stay flat when the grouping is linear.
+
+    python -m benchmarks.task_tree
+"""
+import datetime
+import gc
+import json
+import time
+
+from core.storage import task_storage, dictionary_storage
+
+SUBTASKS_PER_TASK = 4
+EVENTS_PER_TASK = 6
+
+NOT_DEFINED, MOV_MARSH, MST_IN, CHANGE, ID_MARSH_TRS = 1, 2, 3, 4, 5
+LST_ROWS = [(NOT_DEFINED, "NotDefined", 0), (MOV_MARSH, "MovMarsh", 0), (MST_IN, "Mst_In", 0), (CHANGE, "Change", 0),
+            (ID_MARSH_TRS, "ID_MARSH_TRS", 0)]
+
+
+def generate_rows(task_count: int) -> list[tuple]:
+    rows = []
+    start = datetime.datetime(2024, 1, 1)
+    event_data = json.dumps([{"8794": "8680"}])
+    next_id = task_count + 1
+
+    for task_id in range(1, task_count + 1):
+        dt = start + datetime.timedelta(hours=task_id)
+        task = (task_id, 31, task_id, dt, dt + datetime.timedelta(hours=1), None, None, NOT_DEFINED, MOV_MARSH,
+                "task")
+        route = (ID_MARSH_TRS, 100 + task_id, "A000AA", 200 + task_id, "B000BB", 300 + task_id, 1, "route")
+        no_route = (ID_MARSH_TRS, None, None, None, None, None, None, None)
+
+        for event_idx in range(EVENTS_PER_TASK):
+            event_id = task_id * 100 + event_idx
+            event = (event_id, CHANGE, "event", task_id, dt + datetime.timedelta(minutes=event_idx), event_data)
+            rows.append(task + route + (None, None, None, None) + event)
+
+        for subtask_idx in range(SUBTASKS_PER_TASK):
+            subtask_id = next_id
+            next_id += 1
+            sdt = dt + datetime.timedelta(minutes=subtask_idx * 10)
+            subtask = (subtask_id, 31, task_id, sdt, sdt + datetime.timedelta(minutes=10), None, None, NOT_DEFINED,
+                       MST_IN, "subtask")
+            station = (400 + subtask_idx, "station", 55.75, 37.61)
+            rows.append(subtask + no_route + station + (None,) * 6)
+
+    return rows
+
+
+def measure(rows: list[tuple], repeat: int = 5) -> float:
+    task_rows, param_rows, event_rows = task_storage.split_joined_rows(rows)
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            task_storage.build_task_tree(task_rows, param_rows, event_rows)
+            best = min(best, time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return best
+
+
+def main():
+    dictionary_storage.populate(LST_ROWS, [])
+    print(f"{'rows':>10} {'total, ms':>12} {'per row, us':>12}")
+    for task_count in (125, 250, 500, 1000, 2000):
+        rows = generate_rows(task_count)
+        elapsed = measure(rows)
+        print(f"{len(rows):>10} {elapsed * 1000:>12.2f} {elapsed / len(rows) * 1_000_000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,5 +12,49 @@ class Settings(BaseSettings):
     host: str | None = None
     port: int | None = None
 
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_recycle: int = 3600
+    seans_id_sotr: int = 31
+    storage_timeout: float = 30
+
+    sql_echo: bool = False
+    sql_slow_query_threshold: float = 0.5
+    sql_slow_query_sample_rate: float = 1.0
+    sql_capture_plan: bool = True
+
+    redis_host: str = "127.0.0.1"
+    redis_port: int = 6379
+    cache_executor_workers: int = 4
+    cache_timeout: float = 1.0
+
+    task_batched_loading: bool = True
+
+    dictionary_refresh_interval: int = 600
+    dictionary_redis_mirror: bool = False
+
+    task_cache_enabled: bool = True
+    task_cache_ttl: int = 300
+    task_cache_local_ttl: int = 30
+    task_cache_local_size: int = 1000
+    # Delta sync re-reads this many event ids and seconds of task changes below the client's watermark
+    task_delta_event_overlap: int = 1000
+    task_delta_change_overlap: float = 300
+    # Changes the watermarks can't see are picked up by a whole-tree resync this often
+    task_delta_resync_interval: int = 3600
+
+    graphql_max_depth: int = 6
+    graphql_max_cost: int = 2000
+    graphql_document_cache_size: int = 256
+    graphql_persisted_query_ttl: int = 7 * 24 * 3600
+    graphql_persisted_query_local_size: int = 1000
+
+    profile_cache_enabled: bool = True
+    profile_cache_ttl: int = 600
+    profile_cache_local_ttl: int = 60
+    profile_cache_local_size: int = 10000
+    # Sign the profile into issued access tokens, so requests are authenticated without reading it
+    profile_token_claims: bool = False
+
 
 Config = Settings()
@@ -1,24 +1,24 @@
 import pickle
 import socket
-from firebird.driver import connect, driver_config
+from firebird.driver import connect, driver_config, Connection
 from redis import StrictRedis
 from redis_cache import RedisCache
 from sqlalchemy import QueuePool
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 import codecs
 
 
 from core.config import Config
+from .instrumentation import statement_instrumentation
 
 driver_config.server_defaults.host.value = Config.firebird_host
 driver_config.server_defaults.user.value = Config.firebird_user
 driver_config.server_defaults.password.value = Config.firebird_password
 
 
-def get_connection():
-    con = connect(Config.firebird_database, no_db_triggers=False, charset='WIN1251')
+SEANS_REMOTE_VER = '2024052901'
 
-    stmt_register_connection = f"""
+STMT_REGISTER_CONNECTION = """
 UPDATE SEANS 
 set SEANS_STATUS    = 2,
             SEANS_ID_SOTR   = ?,--14,
@@ -27,22 +27,39 @@ set SEANS_STATUS    = 2,
             SEANS_REMOTE_VER = ?
 where ID_SEANS = RDB$GET_CONTEXT('USER_SESSION', 'ID_SEANS');
     """
+
+
+def register_connection(con: Connection):
+    # SEANS is bound to the attachment, so every physical connection is registered exactly once
     cursor = con.cursor()
-    cursor.execute(stmt_register_connection, (31, socket.gethostname(), '2024052901'))
+    cursor.execute(STMT_REGISTER_CONNECTION, (Config.seans_id_sotr, socket.gethostname(), SEANS_REMOTE_VER))
     cursor.close()
     con.commit()
+
+
+def get_connection():
+    con = connect(Config.firebird_database, no_db_triggers=False, charset='WIN1251')
+    register_connection(con)
     return con
 
 
-def __serializer(obj):
+def serializer(obj):
     return codecs.encode(pickle.dumps(obj), "base64").decode()
 
 
-def __deserializer(obj):
+def deserializer(obj):
     return pickle.loads(codecs.decode(obj.encode(), "base64"))
 
 
 # pool = QueuePool(get_connection, pool_size=5, max_overflow=0, pre_ping=True, dialect=)
-redis_client = StrictRedis(host="127.0.0.1", decode_responses=True)
-redis_cache_obj = lambda : RedisCache(redis_client, serializer=__serializer, deserializer=__deserializer)
-engine = create_engine(f'firebird+firebird://{Config.firebird_user}:{Config.firebird_password}@{Config.firebird_host}/{Config.firebird_database}?charset=WIN1251', echo=True)
\ No newline at end of file
+redis_client = StrictRedis(host=Config.redis_host, port=Config.redis_port, decode_responses=True)
+redis_cache_obj = lambda : RedisCache(redis_client, serializer=serializer, deserializer=deserializer)
+engine = create_engine(f'firebird+firebird://{Config.firebird_user}:{Config.firebird_password}@{Config.firebird_host}/{Config.firebird_database}?charset=WIN1251', echo=Config.sql_echo,
+                       pool_size=Config.db_pool_size, max_overflow=Config.db_max_overflow,
+                       pool_recycle=Config.db_pool_recycle, pool_pre_ping=True)
+statement_instrumentation.attach(engine)
+
+
+@event.listens_for(engine, "connect")
+def register_pool_connection(dbapi_connection, connection_record):
+    register_connection(dbapi_connection)
\ No newline at end of file
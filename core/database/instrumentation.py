@@ -0,0 +1,154 @@
+import bisect
+import logging
+import random
+import re
+import reprlib
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+from enum import Enum
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine.cursor import FullyBufferedCursorFetchStrategy
+
+from core.config import Config
+
+slow_query_logger = logging.getLogger("mp_driver.slow_query")
+
+# Upper bounds of the statement latency histogram buckets, in seconds
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float("inf"))
+
+_params_repr = reprlib.Repr()
+_params_repr.maxlist = _params_repr.maxtuple = 20
+_params_repr.maxdict = 30
+_params_repr.maxstring = 200
+_params_repr.maxother = 200
+
+_WHITESPACE = re.compile(r"\s+")
+_COMMENT = re.compile(r"--[^\n]*")
+
+
+@dataclass
+class StatementStats:
+    count: int = 0
+    errors: int = 0
+    rows: int = 0
+    total_time: float = 0
+    max_time: float = 0
+    histogram: list[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+
+    def as_dict(self) -> dict:
+        return {"count": self.count,
+                "errors": self.errors,
+                "rows": self.rows,
+                "total_time": self.total_time,
+                "avg_time": self.total_time / self.count if self.count else 0,
+                "max_time": self.max_time,
+                "histogram": dict(zip(LATENCY_BUCKETS, self.histogram))}
+
+
+class StatementInstrumentation:
+    """
+    Per-statement timings collected from engine cursor events.
+
+    Statements registered with `register_statements` are grouped under their names, everything else under a
+    normalized prefix of its SQL. Result rows are buffered right after execution, so the recorded time includes
+    fetching and the row count is exact for selects. Statements slower than `slow_threshold` seconds are logged
+    with their parameters and Firebird plan, `slow_sample_rate` of them at most.
+    """
+
+    def __init__(self, slow_threshold: float = 0.5, slow_sample_rate: float = 1.0, capture_plan: bool = True):
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.capture_plan = capture_plan
+
+        self._names: dict[int, str] = {}
+        self._stats: dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def register_statements(self, statements: typing.Iterable[Enum] | typing.Mapping[str, typing.Any]):
+        items = statements.items() if isinstance(statements, typing.Mapping) else (
+            (member.name, member.value) for member in statements)
+        for name, stmt in items:
+            self._names[id(stmt)] = name
+
+    def attach(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(engine, "handle_error", self.handle_error)
+
+    def statement_name(self, statement: str, context) -> str:
+        compiled = getattr(context, "compiled", None)
+        if compiled is not None:
+            name = self._names.get(id(compiled.statement))
+            if name is not None:
+                return name
+        return _WHITESPACE.sub(" ", _COMMENT.sub("", statement)).strip()[:80]
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._mp_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_mp_started", None)
+        if started is None:
+            return
+
+        if cursor.description is not None and not context.execution_options.get("stream_results"):
+            rows = cursor.fetchall()
+            context.cursor_fetch_strategy = FullyBufferedCursorFetchStrategy(cursor, cursor.description, rows)
+            row_count = len(rows)
+        else:
+            row_count = max(cursor.rowcount, 0)
+
+        elapsed = time.perf_counter() - started
+        name = self.statement_name(statement, context)
+        self._record(name, elapsed, row_count)
+
+        if elapsed >= self.slow_threshold and random.random() < self.slow_sample_rate:
+            self._log_slow(name, elapsed, row_count, cursor, statement, parameters, executemany)
+
+    def handle_error(self, exception_context):
+        context = exception_context.execution_context
+        if context is None or getattr(context, "_mp_started", None) is None:
+            return
+        name = self.statement_name(exception_context.statement or "", context)
+        with self._lock:
+            self._stats.setdefault(name, StatementStats()).errors += 1
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _record(self, name: str, elapsed: float, row_count: int):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = StatementStats()
+            stats.count += 1
+            stats.rows += row_count
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def _log_slow(self, name, elapsed, row_count, cursor, statement, parameters, executemany):
+        plan = None
+        if self.capture_plan:
+            try:
+                plan = cursor.statement.plan
+            except Exception as exc:
+                plan = f"<unavailable: {exc}>"
+
+        slow_query_logger.warning("Slow statement %s: %.3fs, %s rows%s\n%s\nparams: %s\nplan: %s",
+                                  name, elapsed, row_count, " (executemany)" if executemany else "",
+                                  statement.strip(), _params_repr.repr(parameters), plan)
+
+
+statement_instrumentation = StatementInstrumentation(slow_threshold=Config.sql_slow_query_threshold,
+                                                     slow_sample_rate=Config.sql_slow_query_sample_rate,
+                                                     capture_plan=Config.sql_capture_plan)
@@ -1,12 +1,47 @@
-import queue
+import bisect
+import collections
+import functools
+import logging
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
 
 from firebird.driver import Connection as BaseConnection, connect, Cursor
 
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the acquire wait-time histogram buckets, in seconds
+WAIT_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+@dataclass
+class PoolStats:
+    size: int
+    idle: int
+    in_use: int
+    waiting: int
+    acquired: int
+    timeouts: int
+    created: int
+    discarded: int
+    wait_histogram: dict[float, int] = field(default_factory=dict)
+
 
 class PoolConnection:
     def __init__(self, connection: BaseConnection, pool: 'PoolManager'):
         self._connection: BaseConnection = connection
         self.__pool: PoolManager = pool
+        self.created_at: float = time.monotonic()
+        self.released_at: float = self.created_at
 
     @property
     def is_alive(self) -> bool:
@@ -17,6 +52,13 @@ class PoolConnection:
         con = connect(*args, **kwargs)
         return cls(con, pool)
 
+    def ping(self) -> bool:
+        try:
+            self._connection.ping()
+        except Exception:
+            return False
+        return True
+
     def cursor(self) -> Cursor:
         return self._connection.cursor()
 
@@ -26,43 +68,241 @@ class PoolConnection:
     def close_connection(self):
         if not self._connection.is_closed():
             self._connection.close()
-            assert self.is_alive == False
+
+    def __enter__(self) -> 'PoolConnection':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
 class PoolManager:
+    """
+    Bounded pool of firebird connections.
+
+    `connect()` waits at most `acquire_timeout` seconds for a connection. Connections older than `max_lifetime` or
+    idle for longer than `idle_timeout` are closed instead of being handed out, and a background probe pings idle
+    connections every `probe_interval` seconds. `close()` stops handing out connections and waits for the ones in
+    use to be returned before closing everything.
+    """
     MAX_CONNECTION: int = 5
-    _all_connection: list[PoolConnection] = []
-    _available_connections: queue.Queue[PoolConnection] = None
 
-    def __init__(self, **connection_args):
-        self.__connection_args = connection_args
-        if self._available_connections is None:
-            self._available_connections = queue.Queue()
+    def __init__(self, connection_factory: typing.Callable[[], BaseConnection] | None = None, *,
+                 max_connections: int = MAX_CONNECTION, min_connections: int = 0, acquire_timeout: float = 30,
+                 max_lifetime: float = 3600, idle_timeout: float = 600, probe_interval: float | None = 30,
+                 **connection_args):
+        self.__connection_factory = connection_factory or functools.partial(connect, **connection_args)
+        self.max_connections = max_connections
+        self.min_connections = min_connections
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+
+        self._all_connections: set[PoolConnection] = set()
+        self._available_connections: collections.deque[PoolConnection] = collections.deque()
+        self._condition = threading.Condition()
+        self._opening = 0
+        self._probing = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._acquired = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_histogram = [0] * len(WAIT_BUCKETS)
+
+        self._stop_probe = threading.Event()
+        self._probe_thread: threading.Thread | None = None
 
         self.build_connections()
+        if probe_interval:
+            self.start_probe()
+
+    @property
+    def in_use(self) -> int:
+        return len(self._all_connections) - len(self._available_connections) - self._probing
 
     def build_connections(self):
-        for _ in range(self.MAX_CONNECTION):
-            self.make_connection()
+        for _ in range(self.min_connections - len(self._all_connections)):
+            self.release_connection(self.make_connection())
 
     def make_connection(self) -> PoolConnection:
-        con = PoolConnection.create(self, **self.__connection_args)
-        self._all_connection.append(con)
-        self.release_connection(con)
+        con = PoolConnection(self.__connection_factory(), self)
+        with self._condition:
+            self._all_connections.add(con)
+            self._created += 1
         return con
 
-    def connect(self) -> PoolConnection:
-        for _ in range(self.MAX_CONNECTION):
-            con = self._available_connections.get()
-            if con.is_alive:
-                return con
-            self._all_connection.remove(con)
-            return self.make_connection()
+    def connect(self, timeout: float | None = None) -> PoolConnection:
+        started = time.monotonic()
+        deadline = started + (self.acquire_timeout if timeout is None else timeout)
+        expired: list[PoolConnection] = []
+
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("Pool is closed")
+
+                    while self._available_connections:
+                        con = self._available_connections.pop()
+                        now = time.monotonic()
+                        if self._is_expired(con, now) or now - con.released_at > self.idle_timeout or not con.is_alive:
+                            self._forget(con)
+                            expired.append(con)
+                            continue
+                        self._record_acquire(started)
+                        break
+                    else:
+                        con = None
+
+                    if con is not None:
+                        break
+
+                    if len(self._all_connections) + self._opening < self.max_connections:
+                        self._opening += 1
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No connection available within {deadline - started:.3f}s")
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        self._close_all(expired)
+        if con is not None:
+            return con
+
+        try:
+            con = self.make_connection()
+        finally:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+
+        with self._condition:
+            self._record_acquire(started)
+        return con
+
+    def release_connection(self, con: PoolConnection):
+        with self._condition:
+            if con not in self._all_connections:
+                return
+            con.released_at = time.monotonic()
+            if self._closed or self._is_expired(con, con.released_at) or not con.is_alive:
+                self._forget(con)
+            else:
+                self._available_connections.append(con)
+                con = None
+            self._condition.notify_all()
+
+        if con is not None:
+            self._close_all([con])
+
+    def probe(self):
+        now = time.monotonic()
+        with self._condition:
+            candidates = list(self._available_connections)
+            self._available_connections.clear()
+            self._probing = len(candidates)
+
+        alive, dead = [], []
+        for con in candidates:
+            if self._is_expired(con, now) or now - con.released_at > self.idle_timeout or not con.ping():
+                dead.append(con)
+            else:
+                alive.append(con)
+
+        with self._condition:
+            self._probing = 0
+            for con in dead:
+                self._forget(con)
+            if self._closed:
+                dead.extend(alive)
+                for con in alive:
+                    self._forget(con)
+            else:
+                # Connections released during the probe are the most recently used, so they stay on top
+                self._available_connections.extendleft(reversed(alive))
+            self._condition.notify_all()
+
+        self._close_all(dead)
+        if not self._closed:
+            self.build_connections()
+
+    def start_probe(self):
+        if self._probe_thread is not None:
+            return
+
+        def run():
+            while not self._stop_probe.wait(self.probe_interval):
+                try:
+                    self.probe()
+                except Exception as exc:
+                    logger.warning("Pool probe failed: %s", exc)
+
+        self._stop_probe.clear()
+        self._probe_thread = threading.Thread(target=run, name="pool-probe", daemon=True)
+        self._probe_thread.start()
+
+    def close(self, timeout: float = 30):
+        self._stop_probe.set()
+        deadline = time.monotonic() + timeout
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            while self.in_use > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Closing pool with %s connections still in use", self.in_use)
+                    break
+                self._condition.wait(remaining)
+
+            connections = list(self._all_connections)
+            self._all_connections.clear()
+            self._available_connections.clear()
+
+        self._close_all(connections)
+
+    def stats(self) -> PoolStats:
+        with self._condition:
+            return PoolStats(size=len(self._all_connections),
+                             idle=len(self._available_connections),
+                             in_use=self.in_use,
+                             waiting=self._waiting,
+                             acquired=self._acquired,
+                             timeouts=self._timeouts,
+                             created=self._created,
+                             discarded=self._discarded,
+                             wait_histogram=dict(zip(WAIT_BUCKETS, self._wait_histogram)))
+
+    def __enter__(self) -> 'PoolManager':
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        print("GRACEFULLY CLOSE CONNECTIONS")
-        for con in self._all_connection:
-            con.close_connection()
+        self.close()
+
+    def _is_expired(self, con: PoolConnection, now: float) -> bool:
+        return now - con.created_at > self.max_lifetime
+
+    def _forget(self, con: PoolConnection):
+        self._all_connections.discard(con)
+        self._discarded += 1
+
+    def _record_acquire(self, started: float):
+        self._acquired += 1
+        self._wait_histogram[bisect.bisect_left(WAIT_BUCKETS, time.monotonic() - started)] += 1
 
-    def release_connection(self, con):
-        self._available_connections.put(con)
+    @staticmethod
+    def _close_all(connections: typing.Iterable[PoolConnection]):
+        for con in connections:
+            try:
+                con.close_connection()
+            except Exception as exc:
+                logger.warning("Failed to close pooled connection: %s", exc)
@@ -1,4 +1,4 @@
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
 
 class MPDriverException(Exception):
@@ -18,4 +18,4 @@ class MPDriverException(Exception):
                 "ru": self.mnemonic
             }
         }
-        return JSONResponse(content, status_code=self.status)
+        return ORJSONResponse(content, status_code=self.status)
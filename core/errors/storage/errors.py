@@ -0,0 +1,11 @@
+from ..base import MPDriverException
+
+
+def storage_timeout():
+    raise MPDriverException(504, "StorageTimeout", "Превышено время ожидания ответа базы данных",
+                            "Database didn't respond in time")
+
+
+def unknown_dictionary_entry(name: str):
+    raise MPDriverException(500, "UnknownDictionaryEntry", f"Значение {name} не найдено в справочнике LST",
+                            f"{name} is not in the LST dictionary")
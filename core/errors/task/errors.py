@@ -12,8 +12,7 @@ def should_provide_error_text_with_cancelled_status():
                             "Attribute error_text should be provided")
 
 
-def update_task_by_chain_failed(exc: Exception):
-    raise MPDriverException(400, "ChainFailed", """Ошибка в отправке данных: Данные должны приходить в формате списка в следующем формате:
+_CHAIN_FAILED_MNEMONIC = """Ошибка в отправке данных: Данные должны приходить в формате списка в следующем формате:
      task (InProgress) ->
       subtask (InProgress) ->
        subtask(Completed/Cancelled) ->
@@ -27,4 +26,17 @@ def update_task_by_chain_failed(exc: Exception):
             subtask(Completed/Cancelled) -> subtask(InProgress);
                 или
             subtask(Completed/Cancelled) -> task(Completed)
-         """, f"<{type(exc)}> : {str(exc)}")
\ No newline at end of file
+         """
+
+
+def update_task_by_chain_failed(exc: Exception):
+    raise MPDriverException(400, "ChainFailed", _CHAIN_FAILED_MNEMONIC, f"<{type(exc)}> : {str(exc)}")
+
+
+def chain_event_failed(idx: int, task_id: int, status: str, reason: str):
+    raise MPDriverException(400, "ChainFailed", _CHAIN_FAILED_MNEMONIC,
+                            f"Event #{idx} (taskId={task_id}, status={status}): {reason}")
+
+
+def invalid_cursor():
+    raise MPDriverException(400, "InvalidCursor", "Некорректный курсор страницы", "Page cursor is invalid or expired")
@@ -1,8 +1,29 @@
+from core.database.db import redis_client
+from core.storage import dictionary_storage
+
+KEY_PREFIX = "mp_driver:dictionary"
+
+
+def _upload(name: str, names: dict[int, str], ids: dict[str, int]):
+    names_key, ids_key = f"{KEY_PREFIX}:{name}:names", f"{KEY_PREFIX}:{name}:ids"
+    names = {id_: name_sh for id_, name_sh in names.items() if name_sh is not None}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(names_key, ids_key)
+    if names:
+        pipe.hset(names_key, mapping=names)
+    if ids:
+        pipe.hset(ids_key, mapping=ids)
+    pipe.execute()
 
 
 def upload_lst_to_redis():
-    pass
+    _upload("lst", dictionary_storage.lst_names, dictionary_storage.lst_ids)
 
 
 def upload_vlst_to_redis():
-    pass
+    _upload("vlst", dictionary_storage.vlst_names, dictionary_storage.vlst_ids)
+
+
+def upload_dictionaries_to_redis():
+    upload_lst_to_redis()
+    upload_vlst_to_redis()
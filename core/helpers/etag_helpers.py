@@ -0,0 +1,34 @@
+import hashlib
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from core.helpers.profile_helpers import get_user_from_token
+from core.model.profile.db import ProfileDB
+from core.storage import task_cache, run_in_cache_executor
+
+
+def if_none_match(header: str | None, etag: str) -> bool:
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+async def task_etag(request: Request, response: Response, user: ProfileDB = Depends(get_user_from_token)):
+    """
+    Strong ETag for task read endpoints, derived from the version of the user's tasks that every writer bumps.
+
+    Answers 304 before the endpoint runs when the client already has the current representation, so a 304 costs one
+    Redis read and no database queries. Without the version (cache disabled or Redis unavailable) no ETag is sent.
+    """
+    version = await run_in_cache_executor(task_cache.validator, user.id)
+    if version is None:
+        return
+
+    representation = f"{user.id}:{version}:{request.url.path}?{request.url.query}"
+    etag = '"' + hashlib.sha256(representation.encode()).hexdigest()[:40] + '"'
+    if if_none_match(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
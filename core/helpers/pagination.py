@@ -0,0 +1,94 @@
+import base64
+import binascii
+import datetime
+import json
+import typing
+
+from fastapi import Response
+
+from core.errors.task.errors import invalid_cursor
+from core.model.task.db import DBAppTask, DBEvent
+
+T = typing.TypeVar("T")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Cursors are opaque to clients: urlsafe base64 of a json list that starts with the cursor kind
+TASK_CURSOR = "t"
+EVENT_CURSOR = "e"
+WATERMARK = "w"
+
+
+def encode_cursor(kind: str, *values) -> str:
+    raw = json.dumps([kind, *values], separators=(",", ":"), default=datetime.datetime.isoformat)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, kind: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        invalid_cursor()
+    if not isinstance(values, list) or not values or values[0] != kind:
+        invalid_cursor()
+    return values[1:]
+
+
+def task_cursor(task: DBAppTask) -> str:
+    return encode_cursor(TASK_CURSOR, task.start_pln, task.id)
+
+
+def decode_task_cursor(cursor: str | None) -> typing.Optional[tuple[datetime.datetime, int]]:
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor, TASK_CURSOR)
+    try:
+        return datetime.datetime.fromisoformat(values[0]), int(values[1])
+    except (IndexError, TypeError, ValueError):
+        invalid_cursor()
+
+
+def event_cursor(event: DBEvent) -> str:
+    return encode_cursor(EVENT_CURSOR, event.id)
+
+
+def decode_event_cursor(cursor: str | None) -> typing.Optional[int]:
+    if cursor is None:
+        return None
+    values = decode_cursor(cursor, EVENT_CURSOR)
+    try:
+        return int(values[0])
+    except (IndexError, TypeError, ValueError):
+        invalid_cursor()
+
+
+def page_size(limit: int | None) -> int:
+    return min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+
+def paginate(items: typing.Sequence[T], limit: int, cursor_of: typing.Callable[[T], str]) -> tuple[list[T], str | None]:
+    # `items` holds up to limit + 1 entries; the extra one only tells that there is a next page
+    page = list(items[:limit])
+    return page, cursor_of(page[-1]) if len(items) > limit and page else None
+
+
+def set_next_cursor(response: Response, cursor: str | None):
+    if cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+
+def encode_watermark(event_id: int, changed_at: datetime.datetime, synced_at: float) -> str:
+    return encode_cursor(WATERMARK, event_id, changed_at, synced_at)
+
+
+def decode_watermark(watermark: str | None) -> typing.Optional[tuple[int, datetime.datetime, float]]:
+    # `synced_at` is the time of the last whole-tree sync; watermarks without it are due for one
+    if watermark is None:
+        return None
+    values = decode_cursor(watermark, WATERMARK)
+    try:
+        return int(values[0]), datetime.datetime.fromisoformat(values[1]), float(values[2]) if len(values) > 2 else 0.0
+    except (IndexError, TypeError, ValueError):
+        invalid_cursor()
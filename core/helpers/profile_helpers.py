@@ -4,12 +4,12 @@ from fastapi.security import OAuth2PasswordBearer
 
 from core.config import Config
 from core.model.profile.db import ProfileDB
-from core.storage import profile_storage
+from core.storage import async_profile_storage, profile_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/phone")
 
 
-def get_user_from_token(token: str = Depends(oauth2_scheme)) -> ProfileDB:
+async def get_user_from_token(token: str = Depends(oauth2_scheme)) -> ProfileDB:
     try:
         data = jwt.decode(token, algorithms="HS256", key=Config.secret)
     except jwt.exceptions.ExpiredSignatureError as err:
@@ -18,4 +18,18 @@ def get_user_from_token(token: str = Depends(oauth2_scheme)) -> ProfileDB:
     except jwt.exceptions.InvalidSignatureError as err:
         raise HTTPException(status_code=401, detail=str(err))
 
-    return profile_storage.get_profile_by_id(data['profile_id'])
+    # Claims are only trusted while enabled, so turning them off falls back to the stored profile right away
+    if Config.profile_token_claims and "profile" in data:
+        return ProfileDB(id=data['profile_id'], **data['profile'])
+
+    profile = profile_cache.get_local(data['profile_id'])
+    if profile is not None:
+        return profile
+    return await async_profile_storage.fetch_profile(data['profile_id'])
+
+
+def profile_claims(profile: ProfileDB) -> dict:
+    claims = {"profile_id": profile.id}
+    if Config.profile_token_claims:
+        claims["profile"] = profile.model_dump(exclude={"id"})
+    return claims
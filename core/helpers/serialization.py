@@ -0,0 +1,27 @@
+import typing
+
+import orjson
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from core.model.task.db import DBAppTask, DBSubTask, DBEvent, DBTaskDelta
+from core.model.task.raw_json import RAW_JSON_CONTEXT
+
+# Built once at import; dumping through them applies the camelCase aliases without validating the payload again
+task_adapter = TypeAdapter(DBAppTask)
+tasks_adapter = TypeAdapter(list[DBAppTask])
+subtask_adapter = TypeAdapter(DBSubTask)
+subtasks_adapter = TypeAdapter(list[DBSubTask])
+events_adapter = TypeAdapter(list[DBEvent])
+task_delta_adapter = TypeAdapter(DBTaskDelta)
+
+
+def dump_json(adapter: TypeAdapter, value: typing.Any) -> bytes:
+    # Stored event data is embedded as is instead of being parsed and encoded again
+    return orjson.dumps(adapter.serializer.to_python(value, by_alias=True, context=RAW_JSON_CONTEXT))
+
+
+def json_response(adapter: TypeAdapter, value: typing.Any, response: Response | None = None) -> Response:
+    # Headers set on the injected response (ETag, X-Next-Cursor) are carried over, FastAPI drops them otherwise
+    return Response(dump_json(adapter, value), media_type="application/json",
+                    headers=response.headers if response is not None else None)
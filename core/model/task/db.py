@@ -2,13 +2,31 @@ import datetime
 import typing
 from typing import Union
 
-from pydantic import BaseModel, Field, ConfigDict, AliasGenerator, Json
+from pydantic import BaseModel, Field, ConfigDict, AliasGenerator
 from pydantic.alias_generators import to_camel
 
 from .enums import StatusEnum, TaskTypeEnum, SubtaskTypeEnum, MarshTemperatureProperty
+from .raw_json import RawJSON
 
 general_model_config = ConfigDict(alias_generator=AliasGenerator(serialization_alias=to_camel))
 
+M = typing.TypeVar("M", bound=BaseModel)
+
+
+def construct_trusted(cls: type[M], **values) -> M:
+    """
+    Build a model from trusted database values without validation.
+
+    A leaner `model_construct`: every field has to be passed, as no defaults are filled in and no extra keys are
+    dropped. Callers convert values to the field types themselves.
+    """
+    model = cls.__new__(cls)
+    object.__setattr__(model, "__dict__", values)
+    object.__setattr__(model, "__pydantic_fields_set__", set(values))
+    object.__setattr__(model, "__pydantic_extra__", None)
+    object.__setattr__(model, "__pydantic_private__", None)
+    return model
+
 
 class DBModel(BaseModel):
     model_config = general_model_config
@@ -77,5 +95,32 @@ class DBEvent(DBModel):
     type: str
     text: str | None
     parent_id: int = Field(default=0, exclude=True)
-    event_data: list | Json
+    # Stored APP_EVENT_DATA text, parsed only when read
+    event_data: RawJSON
     event_datetime: datetime.datetime
+
+    @property
+    def error(self) -> str | None:
+        data = self.event_data.value
+        for item in data if isinstance(data, list) else [data]:
+            if isinstance(item, dict) and "error" in item:
+                return item["error"]
+        return None
+
+
+class DBTaskEvent(DBEvent):
+    task_id: int
+
+
+class DBTaskDelta(BaseModel):
+    model_config = general_model_config
+
+    # Root tasks with a changed task or subtask row, sent as whole trees. Rows near the previous watermark are sent
+    # again, so tasks and events are merged by id
+    tasks: list[DBAppTask] = []
+    # New events of tasks that are not in `tasks`
+    events: list[DBTaskEvent] = []
+    deleted_task_ids: list[int] = []
+    # `tasks` is the whole tree, which replaces everything the client has
+    resync: bool = False
+    watermark: str
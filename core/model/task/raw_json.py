@@ -0,0 +1,95 @@
+import logging
+import typing
+
+import orjson
+from pydantic import GetCoreSchemaHandler, GetJsonSchemaHandler
+from pydantic.json_schema import JsonSchemaValue
+from pydantic_core import core_schema
+
+logger = logging.getLogger(__name__)
+
+# Serialization context under which RawJSON is emitted as an orjson.Fragment instead of its parsed value
+RAW_JSON_CONTEXT = {"raw_json": True}
+
+_UNPARSED = object()
+
+
+class RawJSON:
+    """
+    JSON document kept as the text it was stored with.
+
+    Stored text is checked once by `from_stored`, as it is embedded into the output unchanged when serialized with
+    `RAW_JSON_CONTEXT`; in every other mode it is serialized as its parsed value.
+    """
+    __slots__ = ("raw", "_value")
+
+    def __init__(self, raw: str | bytes):
+        self.raw = raw
+        self._value = _UNPARSED
+
+    @classmethod
+    def from_value(cls, value: typing.Any) -> 'RawJSON':
+        obj = cls(orjson.dumps(value))
+        obj._value = value
+        return obj
+
+    @classmethod
+    def from_stored(cls, raw: str | bytes) -> 'RawJSON':
+        # Text that is not valid JSON is kept as a JSON string, so it can't break the documents it is embedded in
+        try:
+            value = orjson.loads(raw)
+        except orjson.JSONDecodeError as exc:
+            logger.warning("Stored JSON is malformed, passed on as a string: %s", exc)
+            return cls.from_value(raw if isinstance(raw, str) else raw.decode(errors="replace"))
+        obj = cls(raw)
+        obj._value = value
+        return obj
+
+    @property
+    def value(self) -> typing.Any:
+        if self._value is _UNPARSED:
+            self._value = orjson.loads(self.raw)
+        return self._value
+
+    def __eq__(self, other):
+        if isinstance(other, RawJSON):
+            return self.raw == other.raw or self.value == other.value
+        return self.value == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"RawJSON({self.raw!r})"
+
+    # Only the text is pickled, the parsed value is rebuilt on demand
+    def __getstate__(self):
+        return self.raw
+
+    def __setstate__(self, raw):
+        self.raw = raw
+        self._value = _UNPARSED
+
+    @classmethod
+    def validate(cls, value: typing.Any) -> 'RawJSON':
+        if isinstance(value, RawJSON):
+            return value
+        if isinstance(value, (str, bytes)):
+            return cls.from_stored(value)
+        return cls.from_value(value)
+
+    @staticmethod
+    def serialize(value: 'RawJSON', info: core_schema.SerializationInfo) -> typing.Any:
+        if info.context is not None and info.context.get("raw_json"):
+            return orjson.Fragment(value.raw)
+        return value.value
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: typing.Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(cls.serialize, info_arg=True))
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema: core_schema.CoreSchema,
+                                     handler: GetJsonSchemaHandler) -> JsonSchemaValue:
+        return {}
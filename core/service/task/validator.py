@@ -0,0 +1,96 @@
+from core.errors.auth.errors import no_task_for_current_user
+from core.errors.task.errors import unavailable_status, should_provide_error_text_with_cancelled_status, \
+    chain_event_failed
+from core.model.task.db import DBAppTask, DBSubTask
+from core.model.task.enums import StatusEnum
+from core.model.task.requests import UpdTaskData
+
+FINISHED_STATUSES = (StatusEnum.COMPLETED, StatusEnum.CANCELLED)
+
+
+class ChainValidator:
+    """
+    Validates a submitted status chain against a driver's task snapshot.
+
+    The chain is valid only when it is built from the pairs
+        task (InProgress) -> subtask (InProgress);
+        subtask (Completed/Cancelled) -> subtask (InProgress);
+        subtask (Completed/Cancelled) -> task (Completed)
+    and every pair is checked in both directions. Subtask order and an id -> (task, position) index are computed
+    once, so a chain is validated in a single pass.
+    """
+
+    def __init__(self, tasks: list[DBAppTask]):
+        self.tasks: dict[int, DBAppTask] = {t.id: t for t in tasks}
+        self.subtasks: dict[int, list[DBSubTask]] = {}
+        self.positions: dict[int, tuple[DBAppTask, int]] = {}
+
+        for task in tasks:
+            ordered = sorted(task.subtasks, key=lambda u: u.start_pln)
+            self.subtasks[task.id] = ordered
+            for position, subtask in enumerate(ordered):
+                self.positions[subtask.id] = (task, position)
+
+    @property
+    def root_task_ids(self) -> set[int]:
+        return set(self.tasks)
+
+    def validate(self, events: list[UpdTaskData]) -> list[UpdTaskData]:
+        # Errors report the index of the event in the request, not in the chain ordered by dt
+        ordered = sorted(enumerate(events), key=lambda u: u[1].dt)
+        if len(ordered) == 1:
+            chain_event_failed(0, events[0].task_id, events[0].status.value, "events should be submitted in pairs")
+
+        submitted = {(e.task_id, e.status) for e in events}
+
+        for idx, event in ordered:
+            if event.task_id not in self.tasks and event.task_id not in self.positions:
+                no_task_for_current_user()
+            if event.status == StatusEnum.NOT_DEFINED:
+                unavailable_status()
+            if event.status == StatusEnum.CANCELLED and (event.error_text is None or event.error_text.strip() == ''):
+                should_provide_error_text_with_cancelled_status()
+
+            if event.task_id in self.tasks:
+                reason = self._check_task(event, submitted)
+            else:
+                reason = self._check_subtask(event, submitted)
+
+            if reason is not None:
+                chain_event_failed(idx, event.task_id, event.status.value, reason)
+
+        return [event for _, event in ordered]
+
+    def _check_task(self, event: UpdTaskData, submitted: set[tuple[int, StatusEnum]]) -> str | None:
+        subtasks = self.subtasks[event.task_id]
+        if event.status not in (StatusEnum.IN_PROGRESS, StatusEnum.COMPLETED):
+            return f"status {event.status.value} can't be set for a task"
+        if not subtasks:
+            return "task has no subtasks"
+
+        if event.status == StatusEnum.IN_PROGRESS and (subtasks[0].id, StatusEnum.IN_PROGRESS) not in submitted:
+            return f"subtask {subtasks[0].id} (InProgress) should be submitted with the task"
+        if event.status == StatusEnum.COMPLETED and (subtasks[-1].id, StatusEnum.COMPLETED) not in submitted:
+            return f"subtask {subtasks[-1].id} (Completed) should be submitted with the task"
+        return None
+
+    def _check_subtask(self, event: UpdTaskData, submitted: set[tuple[int, StatusEnum]]) -> str | None:
+        task, position = self.positions[event.task_id]
+        subtasks = self.subtasks[task.id]
+
+        if event.status == StatusEnum.IN_PROGRESS:
+            if position == 0:
+                if (task.id, StatusEnum.IN_PROGRESS) not in submitted:
+                    return f"task {task.id} (InProgress) should be submitted with its first subtask"
+            else:
+                prev_id = subtasks[position - 1].id
+                if not any((prev_id, status) in submitted for status in FINISHED_STATUSES):
+                    return f"previous subtask {prev_id} (Completed/Cancelled) should be submitted"
+            return None
+
+        if position == len(subtasks) - 1:
+            if (task.id, StatusEnum.COMPLETED) not in submitted:
+                return f"task {task.id} (Completed) should be submitted with its last subtask"
+        elif (subtasks[position + 1].id, StatusEnum.IN_PROGRESS) not in submitted:
+            return f"next subtask {subtasks[position + 1].id} (InProgress) should be submitted"
+        return None
@@ -1,4 +1,7 @@
+from .async_storage import AsyncStorage, run_in_storage_executor, run_in_cache_executor
 from .base import BaseStorage
+from .cache import task_cache, profile_cache
+from .dictionary_storage import Storage as DictionaryStorage, dictionary as dictionary_storage
 from .profile_storage import Storage as ProfileStorage
 from .task_storage import Storage as TaskStorage
 from .note_storage import Storage as NoteStorage
@@ -8,3 +11,6 @@ profile_storage = ProfileStorage()
 task_storage = TaskStorage()
 note_storage = NoteStorage()
 
+async_profile_storage = AsyncStorage(profile_storage)
+async_task_storage = AsyncStorage(task_storage)
+async_note_storage = AsyncStorage(note_storage)
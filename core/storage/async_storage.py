@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import Config
+from core.errors.storage.errors import storage_timeout
+
+T = typing.TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Sized to the connection pool: more threads would only wait for a connection
+storage_executor = ThreadPoolExecutor(max_workers=Config.db_pool_size + Config.db_max_overflow,
+                                      thread_name_prefix="storage")
+# Redis calls run apart from it, so a stalled Redis neither holds threads needed for database work nor shows up
+# as a storage timeout
+cache_executor = ThreadPoolExecutor(max_workers=Config.cache_executor_workers, thread_name_prefix="cache")
+
+
+async def run_in_storage_executor(func: typing.Callable[..., T], *args, timeout: float | None = None,
+                                  **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    future = loop.run_in_executor(storage_executor, functools.partial(ctx.run, func, *args, **kwargs))
+    try:
+        # A call still waiting in the executor queue is dropped on timeout or cancellation,
+        # a running one finishes in its thread and its result is discarded
+        return await asyncio.wait_for(future, timeout if timeout is not None else Config.storage_timeout)
+    except asyncio.TimeoutError:
+        storage_timeout()
+
+
+async def run_in_cache_executor(func: typing.Callable[..., T], *args, default: T = None, **kwargs) -> T:
+    # Cached data is optional, so a call that doesn't finish within cache_timeout yields `default`
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    future = loop.run_in_executor(cache_executor, functools.partial(ctx.run, func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, Config.cache_timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Cache call %s timed out", getattr(func, "__qualname__", func))
+        return default
+
+
+class AsyncStorage(typing.Generic[T]):
+    """Awaitable facade over a blocking storage: every method call runs on the storage executor."""
+
+    def __init__(self, storage: T):
+        self._storage = storage
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._storage, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await run_in_storage_executor(attr, *args, **kwargs)
+
+        return call
@@ -1,6 +1,9 @@
-import socket
+import collections
+import dataclasses
+import functools
+import operator
 from contextlib import contextmanager
-from typing import ContextManager, NewType, TypeVar, Optional
+from typing import ContextManager, NewType, TypeVar, Optional, Callable, Sequence, Any
 
 import sqlalchemy
 from firebird.driver import Cursor, Connection
@@ -9,8 +12,49 @@ from sqlalchemy import text, Engine
 from core.database.db import engine
 
 
+T = TypeVar("T")
+
+
+@functools.lru_cache(maxsize=256)
+def keyed_row_type(keys: tuple[str, ...]) -> type:
+    return collections.namedtuple("KeyedROW", [key.upper() for key in keys], rename=True)
+
+
 def row_to_type(self: sqlalchemy.Row):
-    return type("KeyedROW", (), {key.upper(): val for key, val in self._mapping.items()})
+    # One namedtuple type per result shape instead of a new class per row
+    return keyed_row_type(self._fields)._make(self)
+
+
+@functools.lru_cache(maxsize=512)
+def row_mapper(model: type[T], columns: tuple[str, ...], fill_missing: bool = False) -> Callable[[Sequence[Any]], T]:
+    """
+    Row -> `model` converter for one result shape.
+
+    Columns are matched to the annotated fields of `model` by upper-cased name once per (model, columns); columns
+    without a field are skipped. With `fill_missing` required fields without a column are set to None.
+    """
+    fields = model.__annotations__
+    plan = {column.upper(): index for index, column in enumerate(columns) if column.upper() in fields}
+    names, indexes = tuple(plan), tuple(plan.values())
+    if len(indexes) > 1:
+        getter = operator.itemgetter(*indexes)
+    elif indexes:
+        getter = lambda row: (row[indexes[0]],)
+    else:
+        getter = lambda row: ()
+    missing = dict.fromkeys(x for x in _required_fields(model) if x not in plan) if fill_missing else {}
+
+    def build(row: Sequence[Any]) -> T:
+        return model(**missing, **dict(zip(names, getter(row))))
+
+    return build
+
+
+def _required_fields(model: type) -> list[str]:
+    if dataclasses.is_dataclass(model):
+        return [x.name for x in dataclasses.fields(model)
+                if x.init and x.default is dataclasses.MISSING and x.default_factory is dataclasses.MISSING]
+    return list(model.__annotations__)
 
 
 class _SessionCtxManager:
@@ -19,9 +63,8 @@ class _SessionCtxManager:
         self.con: Optional[sqlalchemy.Connection] = None
 
     def __enter__(self) -> sqlalchemy.Connection:
+        # Connections are registered in SEANS by the engine's connect hook and pinged on checkout
         self.con = self.parent.pool.connect()
-        if not self.parent.is_authorized(self.con):
-            self.parent.db_authorization(self.con)
         return self.con
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -32,28 +75,6 @@ class _SessionCtxManager:
 class BaseStorage:
     pool = engine
 
-    @staticmethod
-    def db_authorization(con: sqlalchemy.Connection):
-        stmt = text(f"""
-     UPDATE SEANS 
-set SEANS_STATUS    = 2,
-            SEANS_ID_SOTR   = 31,--14,
-            SEANS_ID_MST    = 0,  -- без привязки
-            SEANS_COMP_NAME = '{socket.gethostname()}',--//'PersonalArea'
-            SEANS_REMOTE_VER = '2024052901'
-where ID_SEANS = RDB$GET_CONTEXT('USER_SESSION', 'ID_SEANS');   
-        """)
-
-        con.execute(stmt)
-        con.commit()
-
-    @staticmethod
-    def is_authorized(con: sqlalchemy.Connection):
-        stmt = text("""
-            select SEANS_ID_SOTR from SEANS where ID_SEANS = RDB$GET_CONTEXT('USER_SESSION', 'ID_SEANS')
-        """)
-        return con.execute(stmt).fetchone()[0] == 31
-
     @classmethod
     def get_session(cls) -> _SessionCtxManager:
         return _SessionCtxManager(parent=cls)
@@ -0,0 +1,319 @@
+import collections
+import logging
+import threading
+import time
+import typing
+
+from redis import StrictRedis
+from redis.client import PubSubWorkerThread
+from redis.exceptions import RedisError
+
+from core.config import Config
+from core.database.db import redis_client, serializer, deserializer
+from core.model.profile.db import ProfileDB
+from core.model.task.db import DBAppTask
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSnapshotCache:
+    """
+    Per-user cache of serialized task trees.
+
+    Snapshots are stored in Redis under a per-user version, so a write only has to bump the version to make
+    every older snapshot unreachable. As every writer bumps it, the version also validates conditional requests. Each
+    process also keeps a bounded LRU of the serialized snapshots it has seen for `local_ttl` seconds; invalidations
+    are broadcast over pub/sub so every instance drops its local copy together.
+    """
+    KEY_PREFIX = "mp_driver:tasks"
+    CHANNEL = "mp_driver:tasks:invalidate"
+
+    def __init__(self, client: StrictRedis, ttl: int, local_ttl: int, local_size: int, enabled: bool = True):
+        self.client = client
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.enabled = enabled
+
+        # user_id -> (version, stored_at, serialized snapshot), least recently used first
+        self._local: collections.OrderedDict[int, tuple[int, float, str]] = collections.OrderedDict()
+        # user_id -> lowest version that may still be stored locally
+        self._min_versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._listener: PubSubWorkerThread | None = None
+
+    def version_key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}:version"
+
+    def snapshot_key(self, user_id: int, version: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}:{version}"
+
+    def version(self, user_id: int) -> int:
+        key = self.version_key(user_id)
+        version = self.client.get(key)
+        if version is None:
+            self._seed_version(self.client, key)
+            version = self.client.get(key)
+        return int(version)
+
+    @staticmethod
+    def _seed_version(client, key: str):
+        # Versions start from the clock, so a version handed out as an ETag isn't reused once Redis loses the key
+        client.set(key, time.time_ns() // 1000, nx=True)
+
+    def get(self, user_id: int) -> typing.Optional[list[DBAppTask]]:
+        if not self.enabled:
+            return None
+        user_id = int(user_id)
+
+        local = self._get_local(user_id)
+        if local is not None:
+            return deserializer(local[2])
+
+        try:
+            version = self.version(user_id)
+            data = self.client.get(self.snapshot_key(user_id, version))
+        except RedisError as exc:
+            logger.warning("Task cache is unavailable: %s", exc)
+            return None
+
+        if data is None:
+            return None
+        self._store_local(user_id, version, data)
+        return deserializer(data)
+
+    def validator(self, user_id: int) -> typing.Optional[str]:
+        # Current version of the user's tasks for conditional requests, None when it can't be told
+        if not self.enabled:
+            return None
+        try:
+            return str(self.version(int(user_id)))
+        except RedisError as exc:
+            logger.warning("Task cache is unavailable: %s", exc)
+            return None
+
+    def fetch(self, user_id: int, loader: typing.Callable[[], list[DBAppTask]]) -> list[DBAppTask]:
+        if not self.enabled:
+            return loader()
+        user_id = int(user_id)
+
+        tasks = self.get(user_id)
+        if tasks is not None:
+            return tasks
+
+        try:
+            # The version is read before loading, so a write that lands meanwhile leaves this snapshot unreachable
+            version = self.version(user_id)
+        except RedisError as exc:
+            logger.warning("Task cache is unavailable: %s", exc)
+            return loader()
+
+        tasks = loader()
+        data = serializer(tasks)
+        try:
+            self.client.set(self.snapshot_key(user_id, version), data, ex=self.ttl)
+        except RedisError as exc:
+            logger.warning("Task cache is unavailable: %s", exc)
+            return tasks
+
+        self._store_local(user_id, version, data)
+        return tasks
+
+    def invalidate(self, user_id: int):
+        if not self.enabled:
+            return
+        user_id = int(user_id)
+
+        self._drop_local(user_id)
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            self._seed_version(pipe, self.version_key(user_id))
+            pipe.incr(self.version_key(user_id))
+            version = pipe.execute()[-1]
+            self.client.publish(self.CHANNEL, f"{user_id}:{version}")
+        except RedisError as exc:
+            logger.warning("Task cache invalidation failed for user %s: %s", user_id, exc)
+
+    def start_listener(self):
+        if not self.enabled or self._listener is not None:
+            return
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.CHANNEL: self._on_message})
+        except RedisError as exc:
+            logger.warning("Task cache invalidation listener is not started: %s", exc)
+            return
+        self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._on_listener_error)
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _get_local(self, user_id: int) -> typing.Optional[tuple[int, float, str]]:
+        with self._lock:
+            local = self._local.get(user_id)
+            if local is None:
+                return None
+            if time.monotonic() - local[1] >= self.local_ttl:
+                del self._local[user_id]
+                return None
+            self._local.move_to_end(user_id)
+            return local
+
+    def _store_local(self, user_id: int, version: int, data: str):
+        with self._lock:
+            if version < self._min_versions.get(user_id, 0):
+                return
+            self._local[user_id] = (version, time.monotonic(), data)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _drop_local(self, user_id: int, version: int = 0):
+        with self._lock:
+            if version > self._min_versions.get(user_id, 0):
+                self._min_versions[user_id] = version
+            local = self._local.get(user_id)
+            if local is not None and (version == 0 or local[0] < version):
+                del self._local[user_id]
+
+    def _on_message(self, message: dict):
+        user_id, version = message["data"].split(":")
+        self._drop_local(int(user_id), int(version))
+
+    def _on_listener_error(self, exc: Exception, pubsub, worker: PubSubWorkerThread):
+        # Invalidations may have been missed while disconnected, so local snapshots can't be trusted anymore
+        logger.warning("Task cache invalidation listener failed: %s", exc)
+        with self._lock:
+            self._local.clear()
+        time.sleep(1)
+
+
+task_cache = TaskSnapshotCache(redis_client, ttl=Config.task_cache_ttl, local_ttl=Config.task_cache_local_ttl,
+                               local_size=Config.task_cache_local_size, enabled=Config.task_cache_enabled)
+
+
+class ProfileCache:
+    """
+    Cache of profiles resolved from access tokens.
+
+    Each process keeps a bounded LRU of recently seen profiles for `local_ttl` seconds in front of Redis, where
+    profiles live for `ttl`. Invalidations delete the Redis entry and are broadcast over pub/sub, so every instance
+    drops its local copy together.
+    """
+    KEY_PREFIX = "mp_driver:profiles"
+    CHANNEL = "mp_driver:profiles:invalidate"
+
+    def __init__(self, client: StrictRedis, ttl: int, local_ttl: int, local_size: int, enabled: bool = True):
+        self.client = client
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self.enabled = enabled
+
+        # profile_id -> (stored_at, profile)
+        self._local: collections.OrderedDict[int, tuple[float, ProfileDB]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._listener: PubSubWorkerThread | None = None
+
+    def key(self, profile_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{profile_id}"
+
+    def get_local(self, profile_id: int) -> typing.Optional[ProfileDB]:
+        if not self.enabled:
+            return None
+        profile_id = int(profile_id)
+
+        with self._lock:
+            local = self._local.get(profile_id)
+            if local is None:
+                return None
+            if time.monotonic() - local[0] >= self.local_ttl:
+                del self._local[profile_id]
+                return None
+            self._local.move_to_end(profile_id)
+            return local[1]
+
+    def fetch(self, profile_id: int,
+              loader: typing.Callable[[], typing.Optional[ProfileDB]]) -> typing.Optional[ProfileDB]:
+        if not self.enabled:
+            return loader()
+        profile_id = int(profile_id)
+
+        profile = self.get_local(profile_id)
+        if profile is not None:
+            return profile
+
+        try:
+            data = self.client.get(self.key(profile_id))
+        except RedisError as exc:
+            logger.warning("Profile cache is unavailable: %s", exc)
+            data = None
+        if data is not None:
+            profile = ProfileDB.model_validate_json(data)
+            self._store_local(profile_id, profile)
+            return profile
+
+        # Missing profiles are not cached, so a profile created later is found on the next request
+        profile = loader()
+        if profile is None:
+            return None
+        try:
+            self.client.set(self.key(profile_id), profile.model_dump_json(), ex=self.ttl)
+        except RedisError as exc:
+            logger.warning("Profile cache is unavailable: %s", exc)
+        self._store_local(profile_id, profile)
+        return profile
+
+    def invalidate(self, profile_id: int):
+        if not self.enabled:
+            return
+        profile_id = int(profile_id)
+
+        self._drop_local(profile_id)
+        try:
+            self.client.delete(self.key(profile_id))
+            self.client.publish(self.CHANNEL, str(profile_id))
+        except RedisError as exc:
+            logger.warning("Profile cache invalidation failed for profile %s: %s", profile_id, exc)
+
+    def start_listener(self):
+        if not self.enabled or self._listener is not None:
+            return
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.CHANNEL: self._on_message})
+        except RedisError as exc:
+            logger.warning("Profile cache invalidation listener is not started: %s", exc)
+            return
+        self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._on_listener_error)
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _store_local(self, profile_id: int, profile: ProfileDB):
+        with self._lock:
+            self._local[profile_id] = (time.monotonic(), profile)
+            self._local.move_to_end(profile_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _drop_local(self, profile_id: int):
+        with self._lock:
+            self._local.pop(profile_id, None)
+
+    def _on_message(self, message: dict):
+        self._drop_local(int(message["data"]))
+
+    def _on_listener_error(self, exc: Exception, pubsub, worker: PubSubWorkerThread):
+        logger.warning("Profile cache invalidation listener failed: %s", exc)
+        with self._lock:
+            self._local.clear()
+        time.sleep(1)
+
+
+profile_cache = ProfileCache(redis_client, ttl=Config.profile_cache_ttl, local_ttl=Config.profile_cache_local_ttl,
+                             local_size=Config.profile_cache_local_size, enabled=Config.profile_cache_enabled)
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+import typing
+
+import sqlalchemy
+from sqlalchemy import text
+
+from core.errors.storage.errors import unknown_dictionary_entry
+from .base import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(BaseStorage):
+    """
+    In-process copy of the LST and VLST dictionaries.
+
+    Both are kept as bidirectional id <-> short name maps, so statuses, task types and param kinds are resolved
+    without a database round trip. The maps are replaced as a whole on every reload.
+    """
+    # An unknown id or name triggers a reload at most this often
+    MISS_RELOAD_INTERVAL = 60
+
+    def __init__(self):
+        self.lst_names: dict[int, str] = {}
+        self.lst_ids: dict[str, int] = {}
+        self.vlst_names: dict[int, str] = {}
+        self.vlst_ids: dict[str, int] = {}
+
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        self._stop_refresh = threading.Event()
+        self._refresher: threading.Thread | None = None
+
+    def load(self):
+        lst_stmt = text("select ID_LST, LST_NAME_SH, LST_DEL from LST order by ID_LST")
+        vlst_stmt = text("select ID_VLST, VLST_NAME_SH from VLST order by ID_VLST")
+        with self.get_session() as session:
+            session: sqlalchemy.Connection
+            lst_rows = session.execute(lst_stmt).fetchall()
+            vlst_rows = session.execute(vlst_stmt).fetchall()
+
+        self.populate(lst_rows, vlst_rows)
+
+    def populate(self, lst_rows: typing.Iterable[tuple], vlst_rows: typing.Iterable[tuple]):
+        lst_names, lst_ids = {}, {}
+        for id_lst, name, deleted in lst_rows:
+            lst_names[id_lst] = name
+            # Same as `select first 1 ID_LST from LST where LST_NAME_SH = ... and LST_DEL = 0`
+            if name is not None and deleted == 0:
+                lst_ids.setdefault(name, id_lst)
+
+        vlst_names, vlst_ids = {}, {}
+        for id_vlst, name in vlst_rows:
+            vlst_names[id_vlst] = name
+            if name is not None:
+                vlst_ids.setdefault(name, id_vlst)
+
+        self.lst_names, self.lst_ids = lst_names, lst_ids
+        self.vlst_names, self.vlst_ids = vlst_names, vlst_ids
+        self._loaded_at = time.monotonic()
+
+    def _resolve(self, attr: str, key):
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self.load()
+
+        value = getattr(self, attr).get(key)
+        if value is None and time.monotonic() - self._loaded_at > self.MISS_RELOAD_INTERVAL:
+            with self._lock:
+                if time.monotonic() - self._loaded_at > self.MISS_RELOAD_INTERVAL:
+                    self.load()
+            value = getattr(self, attr).get(key)
+        return value
+
+    def lst_name(self, id_lst: int) -> typing.Optional[str]:
+        value = self.lst_names.get(id_lst)
+        return value if value is not None else self._resolve("lst_names", id_lst)
+
+    def lst_id(self, name_sh: str) -> typing.Optional[int]:
+        value = self.lst_ids.get(name_sh)
+        return value if value is not None else self._resolve("lst_ids", name_sh)
+
+    def require_lst_id(self, name_sh: str) -> int:
+        # For ids that are bound into statements or written, where a missing entry must not pass as None
+        value = self.lst_id(name_sh)
+        if value is None:
+            unknown_dictionary_entry(name_sh)
+        return value
+
+    def vlst_name(self, id_vlst: int) -> typing.Optional[str]:
+        value = self.vlst_names.get(id_vlst)
+        return value if value is not None else self._resolve("vlst_names", id_vlst)
+
+    def vlst_id(self, name_sh: str) -> typing.Optional[int]:
+        value = self.vlst_ids.get(name_sh)
+        return value if value is not None else self._resolve("vlst_ids", name_sh)
+
+    def start_refresh(self, interval: int, on_refresh: typing.Callable[[], None] | None = None):
+        if self._refresher is not None:
+            return
+
+        def refresh():
+            while not self._stop_refresh.wait(interval):
+                try:
+                    with self._lock:
+                        self.load()
+                    if on_refresh is not None:
+                        on_refresh()
+                except Exception as exc:
+                    logger.warning("Dictionary refresh failed: %s", exc)
+
+        try:
+            with self._lock:
+                self.load()
+            if on_refresh is not None:
+                on_refresh()
+        except Exception as exc:
+            # Lookups load the dictionaries lazily, so a failed start is not fatal
+            logger.warning("Dictionary load failed: %s", exc)
+
+        self._stop_refresh.clear()
+        self._refresher = threading.Thread(target=refresh, name="dictionary-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_refresh(self):
+        if self._refresher is not None:
+            self._stop_refresh.set()
+            self._refresher = None
+
+
+dictionary = Storage()
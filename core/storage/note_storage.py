@@ -5,6 +5,7 @@ from typing import Optional
 import sqlalchemy
 from sqlalchemy import text
 from .base import BaseStorage
+from .cache import task_cache
 from ..model.note.db import AppNoteDB
 
 
@@ -37,6 +38,7 @@ class Storage(BaseStorage):
                 "note_id": id
             })
             session.commit()
+        task_cache.invalidate(user_id)
 
     def create_note(self, user_id: int, note_text: str, time_created: datetime.datetime, task_id: Optional[int] = None):
         stmt = text("""
@@ -56,3 +58,4 @@ class Storage(BaseStorage):
                 "event_data": event_data
             })
             session.commit()
+        task_cache.invalidate(user_id)
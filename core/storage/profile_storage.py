@@ -6,6 +6,7 @@ from sqlalchemy import text
 
 from core.model.profile.db import ProfileDB
 from .base import BaseStorage
+from .cache import profile_cache
 
 
 class Storage(BaseStorage):
@@ -60,6 +61,9 @@ where SOTR.ID_SOTR = :profile_id;
             return None
         return ProfileDB(id=data[0], full_name=data[1], phone_number=data[2])
 
+    def fetch_profile(self, profile_id: int) -> ProfileDB | None:
+        return profile_cache.fetch(profile_id, lambda: self.get_profile_by_id(profile_id))
+
     def generate_profile_auth_code(self, user_id: int, phone_dgt: int) -> int:
 
         code = randint(1000, 9999)
@@ -1,18 +1,74 @@
 import datetime
 import json
+import time
 import typing
 from enum import Enum
 
 import sqlalchemy
-from sqlalchemy import text, TextClause
+from sqlalchemy import text, TextClause, bindparam
 from typing_extensions import deprecated
 
-from core.model.task.db import DBAppTask, DBSubTask, DBMarsh, DBTRS, DBMST, Location, DBEvent
+from core.config import Config
+from core.database.instrumentation import statement_instrumentation
+from core.helpers.pagination import decode_task_cursor, decode_event_cursor, task_cursor, event_cursor, paginate, \
+    encode_watermark, decode_watermark
+from core.model.task.db import DBAppTask, DBSubTask, DBMarsh, DBTRS, DBMST, Location, DBEvent, DBTaskEvent, \
+    DBTaskDelta, construct_trusted
+from core.model.task.raw_json import RawJSON
 from .base import BaseStorage
-from ..model.task.enums import StatusEnum
+from .cache import task_cache
+from .dictionary_storage import dictionary
+from ..model.task.enums import StatusEnum, TaskTypeEnum, SubtaskTypeEnum, MarshTemperatureProperty
 from ..model.task.requests import UpdTaskData
 
 
+_TASK_COLUMNS = """
+select t1.ID_APP_TASK,                                          -- 0
+       t1.APP_TASK_ID_SOTR,                                     -- 1
+       t1.APP_TASK_ID_APP_TASK,                                 -- 2
+       t1.APP_TASK_DT_START_PLN,                                -- 3
+       t1.APP_TASK_DT_END_PLN,                                  -- 4
+       t1.APP_TASK_DT_START_FACT,                               -- 5
+       t1.APP_TASK_DT_END_FACT,                                 -- 6
+       t1.APP_TASK_STATUS,                                      -- 7
+       t1.APP_TASK_TIP,                                         -- 8
+       t1.APP_TASK_TEXT                                         -- 9
+from APP_TASK t1"""
+
+_TASK_PAGE_AFTER = """
+  and (t1.APP_TASK_DT_START_PLN > :after_dt
+       or (t1.APP_TASK_DT_START_PLN = :after_dt and t1.ID_APP_TASK > :after_id))"""
+
+
+def _task_page_stmt(by_status: bool, after: bool) -> TextClause:
+    # Keyset page of root task ids ordered by (APP_TASK_DT_START_PLN, ID_APP_TASK)
+    status_filter = "\n  and t1.APP_TASK_STATUS = :status_id" if by_status else ""
+    return text(f"""
+select first :limit t1.ID_APP_TASK
+from APP_TASK t1
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR = :user_id
+  and t1.ID_APP_TASK = t1.APP_TASK_ID_APP_TASK{status_filter}{_TASK_PAGE_AFTER if after else ""}
+order by t1.APP_TASK_DT_START_PLN, t1.ID_APP_TASK;
+        """)
+
+
+def _event_page_stmt(after: bool) -> TextClause:
+    return text(f"""
+select first :limit e.ID_APP_EVENT,                             -- 0
+       e.APP_EVENT_VID,                                         -- 1
+       e.APP_EVENT_TEXT,                                        -- 2
+       e.APP_EVENT_ID_REC,                                      -- 3
+       e.APP_EVENT_DT,                                          -- 4
+       e.APP_EVENT_DATA                                         -- 5
+from APP_EVENT e
+where e.APP_EVENT_DEL = 0
+  and e.APP_EVENT_ID_REC = :task_id
+  and e.APP_EVENT_VID = :event_vid{" and e.ID_APP_EVENT > :after_id" if after else ""}
+order by e.ID_APP_EVENT;
+        """)
+
+
 class _STMTS(Enum):
     FETCH_TASKS_WITH_SUBTASKS = text(f"""
 select t1.ID_APP_TASK,                                          -- 0
@@ -22,11 +78,11 @@ select t1.ID_APP_TASK,                                          -- 0
        t1.APP_TASK_DT_END_PLN,                                  -- 4
        t1.APP_TASK_DT_START_FACT,                               -- 5
        t1.APP_TASK_DT_END_FACT,                                 -- 6
-       lst_status.LST_NAME_SH,                                  -- 7
-       lst_tip.LST_NAME_SH,                                     -- 8
+       t1.APP_TASK_STATUS,                                      -- 7
+       t1.APP_TASK_TIP,                                         -- 8
        t1.APP_TASK_TEXT,                                        -- 9
 
-       lst_param_tip.LST_NAME_SH as param_tip,                  -- 10
+       param.APP_PARAM_TIP       as param_tip,                  -- 10
 
        --        marsh trs
        trs_1.ID_TRS              as truck_id,                   -- 11
@@ -45,28 +101,167 @@ select t1.ID_APP_TASK,                                          -- 0
 
        -- EVENT
        event.ID_APP_EVENT,                                      -- 22
-       event.LST_NAME_SH,                                   -- 23
+       event.APP_EVENT_VID,                                     -- 23
        event.APP_EVENT_TEXT,                                     -- 24,
         event.APP_EVENT_ID_REC, -- 25
          event.APP_EVENT_DT,  -- 26
          event.APP_EVENT_DATA -- 27
 
 from APP_TASK t1
-         left join LST lst_status
-                   on t1.APP_TASK_STATUS = lst_status.ID_LST
-         left join LST lst_tip on t1.APP_TASK_TIP = lst_tip.ID_LST
          left join APP_PARAM param on param.APP_PARAM_ID_REC = t1.ID_APP_TASK and param.APP_PARAM_DEL = 0
-         LEFT JOIN LST lst_param_tip on param.APP_PARAM_TIP = lst_param_tip.ID_LST
-         left join MARSH_TRS mt on param.APP_PARAM_STR = mt.ID_MARSH_TRS and lst_param_tip.LST_NAME_SH = 'ID_MARSH_TRS'
+         left join MARSH_TRS mt on param.APP_PARAM_STR = mt.ID_MARSH_TRS and param.APP_PARAM_TIP = :marsh_trs_tip
          left join TRS trs_1 on mt.MARSH_TRS_ID_TRS = trs_1.ID_TRS
          left join TRS trs_2 on mt.MARSH_TRS_ID_PRIC = trs_2.ID_TRS
          left join MARSH m on mt.MARSH_TRS_ID_MARSH = m.ID_MARSH
-         left join MST mst on param.APP_PARAM_STR = mst.ID_MST and lst_param_tip.LST_NAME_SH = 'ID_MST'
-         left join (select ID_APP_EVENT, LST_NAME_SH, APP_EVENT_TEXT, APP_EVENT_ID_REC, APP_EVENT_DT, APP_EVENT_DATA from APP_EVENT join LST on ID_LST = APP_EVENT_VID where APP_EVENT_DEL = 0) event
+         left join MST mst on param.APP_PARAM_STR = mst.ID_MST and param.APP_PARAM_TIP = :mst_tip
+         left join (select ID_APP_EVENT, APP_EVENT_VID, APP_EVENT_TEXT, APP_EVENT_ID_REC, APP_EVENT_DT, APP_EVENT_DATA from APP_EVENT where APP_EVENT_DEL = 0) event
              on event.APP_EVENT_ID_REC = t1.ID_APP_TASK
 where t1.APP_TASK_DEL = 0
   and t1.APP_TASK_ID_SOTR = :user_id;
         """)
+    FETCH_TASKS = text(f"""
+{_TASK_COLUMNS}
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR = :user_id;
+        """)
+    FETCH_TASKS_BY_STATUS = text(f"""
+{_TASK_COLUMNS}
+         join APP_TASK root_task on root_task.ID_APP_TASK = t1.APP_TASK_ID_APP_TASK
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR = :user_id
+  and root_task.APP_TASK_DEL = 0
+  and root_task.ID_APP_TASK = root_task.APP_TASK_ID_APP_TASK
+  and root_task.APP_TASK_STATUS = :status_id;
+        """)
+    FETCH_TASK_BY_ID = text(f"""
+{_TASK_COLUMNS}
+         join APP_TASK root_task on root_task.ID_APP_TASK = t1.APP_TASK_ID_APP_TASK
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR = :user_id
+  and root_task.APP_TASK_DEL = 0
+  and root_task.ID_APP_TASK = root_task.APP_TASK_ID_APP_TASK
+  and root_task.ID_APP_TASK = :task_id;
+        """)
+    COUNT_TASKS_BY_STATUS = text("""
+select t1.APP_TASK_STATUS,                                      -- 0
+       count(*)                                                 -- 1
+from APP_TASK t1
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR = :user_id
+  and t1.ID_APP_TASK = t1.APP_TASK_ID_APP_TASK
+group by t1.APP_TASK_STATUS;
+        """)
+    COUNT_TASKS_BY_STATUS_FOR_USERS = text("""
+select t1.APP_TASK_ID_SOTR,                                     -- 0
+       t1.APP_TASK_STATUS,                                      -- 1
+       count(*)                                                 -- 2
+from APP_TASK t1
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_SOTR in :user_ids
+  and t1.ID_APP_TASK = t1.APP_TASK_ID_APP_TASK
+group by t1.APP_TASK_ID_SOTR, t1.APP_TASK_STATUS;
+        """).bindparams(bindparam("user_ids", expanding=True))
+    FETCH_TASK_PAGE = _task_page_stmt(by_status=False, after=False)
+    FETCH_TASK_PAGE_AFTER = _task_page_stmt(by_status=False, after=True)
+    FETCH_TASK_PAGE_BY_STATUS = _task_page_stmt(by_status=True, after=False)
+    FETCH_TASK_PAGE_BY_STATUS_AFTER = _task_page_stmt(by_status=True, after=True)
+    FETCH_TASKS_FOR_ROOTS = text(f"""
+{_TASK_COLUMNS}
+where t1.APP_TASK_DEL = 0
+  and t1.APP_TASK_ID_APP_TASK in :task_ids;
+        """).bindparams(bindparam("task_ids", expanding=True))
+    FETCH_PARAMS_FOR_TASKS = text("""
+select param.APP_PARAM_ID_REC,                                  -- 0
+       param.APP_PARAM_TIP       as param_tip,                  -- 1
+       trs_1.ID_TRS              as truck_id,                   -- 2
+       trs_1.TRS_SID_GOST        as truck_gost,                 -- 3
+       trs_2.ID_TRS              as trailer_id,                 -- 4
+       trs_2.TRS_SID_GOST        as trailer_gost,               -- 5
+       m.ID_MARSH                as marsh_id,                   -- 6
+       m.MARSH_PR_TEPL           as marsh_temperature_property, -- 7
+       m.MARSH_NAME              as marsh_name,                 -- 8
+       mst.ID_MST,                                              -- 9
+       mst.MST_NAME,                                            -- 10
+       mst.MST_SHIR,                                            -- 11
+       mst.MST_DOLG                                             -- 12
+from APP_PARAM param
+         left join MARSH_TRS mt on param.APP_PARAM_STR = mt.ID_MARSH_TRS and param.APP_PARAM_TIP = :marsh_trs_tip
+         left join TRS trs_1 on mt.MARSH_TRS_ID_TRS = trs_1.ID_TRS
+         left join TRS trs_2 on mt.MARSH_TRS_ID_PRIC = trs_2.ID_TRS
+         left join MARSH m on mt.MARSH_TRS_ID_MARSH = m.ID_MARSH
+         left join MST mst on param.APP_PARAM_STR = mst.ID_MST and param.APP_PARAM_TIP = :mst_tip
+where param.APP_PARAM_DEL = 0
+  and param.APP_PARAM_TIP in (:marsh_trs_tip, :mst_tip)
+  and param.APP_PARAM_ID_REC in :task_ids;
+        """).bindparams(bindparam("task_ids", expanding=True))
+    FETCH_EVENTS_FOR_TASKS = text("""
+select e.ID_APP_EVENT,                                          -- 0
+       e.APP_EVENT_VID,                                         -- 1
+       e.APP_EVENT_TEXT,                                        -- 2
+       e.APP_EVENT_ID_REC,                                      -- 3
+       e.APP_EVENT_DT,                                          -- 4
+       e.APP_EVENT_DATA                                         -- 5
+from APP_EVENT e
+where e.APP_EVENT_DEL = 0
+  and e.APP_EVENT_ID_REC in :task_ids;
+        """).bindparams(bindparam("task_ids", expanding=True))
+    FETCH_TASK_EVENTS_BY_TYPE = text("""
+select e.ID_APP_EVENT,                                          -- 0
+       e.APP_EVENT_VID,                                         -- 1
+       e.APP_EVENT_TEXT,                                        -- 2
+       e.APP_EVENT_ID_REC,                                      -- 3
+       e.APP_EVENT_DT,                                          -- 4
+       e.APP_EVENT_DATA                                         -- 5
+from APP_EVENT e
+where e.APP_EVENT_DEL = 0
+  and e.APP_EVENT_ID_REC = :task_id
+  and e.APP_EVENT_VID = :event_vid
+order by e.APP_EVENT_DT;
+        """)
+    FETCH_SYNC_WATERMARK = text("""
+select (select max(e.ID_APP_EVENT)
+        from APP_EVENT e
+                 join APP_TASK t on t.ID_APP_TASK = e.APP_EVENT_ID_REC
+        where t.APP_TASK_ID_SOTR = :user_id),                   -- 0
+       (select max(t.APP_TASK_CH)
+        from APP_TASK t
+        where t.APP_TASK_ID_SOTR = :user_id)                    -- 1
+from RDB$DATABASE;
+        """)
+    FETCH_CHANGED_TASKS = text("""
+select t1.ID_APP_TASK,                                          -- 0
+       t1.APP_TASK_ID_APP_TASK,                                 -- 1
+       t1.APP_TASK_DEL,                                         -- 2
+       t1.APP_TASK_CH                                           -- 3
+from APP_TASK t1
+where t1.APP_TASK_ID_SOTR = :user_id
+  and t1.APP_TASK_CH >= :since_ch;
+        """)
+    FETCH_NEW_EVENTS = text("""
+select e.ID_APP_EVENT,                                          -- 0
+       e.APP_EVENT_VID,                                         -- 1
+       e.APP_EVENT_TEXT,                                        -- 2
+       e.APP_EVENT_ID_REC,                                      -- 3
+       e.APP_EVENT_DT,                                          -- 4
+       e.APP_EVENT_DATA                                         -- 5
+from APP_EVENT e
+         join APP_TASK t on t.ID_APP_TASK = e.APP_EVENT_ID_REC
+where e.ID_APP_EVENT >= :since_event
+  and e.APP_EVENT_DEL = 0
+  and t.APP_TASK_ID_SOTR = :user_id
+  and t.ID_APP_TASK = t.APP_TASK_ID_APP_TASK
+  and t.APP_TASK_DEL = 0
+order by e.ID_APP_EVENT;
+        """)
+    FETCH_TASK_EVENTS_PAGE = _event_page_stmt(after=False)
+    FETCH_TASK_EVENTS_PAGE_AFTER = _event_page_stmt(after=True)
+    CHECK_TASK_OWNER = text("""
+select first 1 ID_APP_TASK from APP_TASK
+where ID_APP_TASK = :task_id
+  and ID_APP_TASK = APP_TASK_ID_APP_TASK
+  and APP_TASK_ID_SOTR = :user_id
+  and APP_TASK_DEL = 0;
+        """)
     FETCH_NEXT_SUBTASK_FOR_TASK = text(
         f"""select ID_APP_TASK from app_task where APP_TASK_ID_APP_TASK = :task_id and APP_TASK_ID_APP_TASK != ID_APP_TASK AND APP_TASK_DEL = 0 and APP_TASK_STATUS not in (8681, 8682) order by APP_TASK_DT_START_PLN""")
 
@@ -86,6 +281,9 @@ where t1.APP_TASK_DEL = 0
         """)
 
 
+statement_instrumentation.register_statements(_STMTS)
+
+
 def generate_event_stmt(profile_id: int, task_id: int, event_dt: datetime.datetime, event_text: str,
                         event_data: dict[str, str], event_params: dict[str, str] | None = None) -> tuple[
     TextClause, dict[str, typing.Any]]:
@@ -99,60 +297,312 @@ def generate_event_stmt(profile_id: int, task_id: int, event_dt: datetime.dateti
                                        }
 
 
+
+# Firebird rejects IN lists longer than 1500 elements
+IN_BATCH_SIZE = 1000
+# Watermark change time for users whose tasks have no APP_TASK_CH yet
+SYNC_EPOCH = datetime.datetime(1900, 1, 1)
+
+
+def fetch_in_batches(con: sqlalchemy.Connection, stmt: TextClause, ids: typing.Sequence[int], key: str = "task_ids",
+                     **params) -> list[sqlalchemy.Row]:
+    rows = []
+    for start in range(0, len(ids), IN_BATCH_SIZE):
+        rows.extend(con.execute(stmt, {**params, key: ids[start:start + IN_BATCH_SIZE]}).fetchall())
+    return rows
+
+
+def status_counts(counts: typing.Iterable[tuple[StatusEnum, int]] = ()) -> dict[StatusEnum, int]:
+    # Every status is present, statuses without tasks count zero
+    result = dict.fromkeys(StatusEnum, 0)
+    for status, count in counts:
+        result[status] += count
+    return result
+
+
+def param_tips() -> dict[str, int]:
+    # An unknown kind matches no params, as with the LST join this replaced
+    return {"marsh_trs_tip": dictionary.lst_id("ID_MARSH_TRS"), "mst_tip": dictionary.lst_id("ID_MST")}
+
+
 class Storage(BaseStorage):
+    # Rows come from the database, so models are built with construct_trusted: no validation, only the conversions
+    # validation would have made (LST names to enums, APP_EVENT_DATA json, numeric coordinates to float)
 
+    # Param rows: APP_PARAM_ID_REC followed by the FETCH_PARAMS_FOR_TASKS route and station columns
     def generate_station(self, row: tuple) -> typing.Optional[DBMST]:
-        return DBMST(id=row[18], name=row[19], location=Location(lat=row[20], lon=row[21], parent_id=row[18]),
-                     parent_id=row[0])
+        return construct_trusted(DBMST, id=row[9], name=row[10], parent_id=row[0],
+                                 location=construct_trusted(Location, lat=float(row[11]), lon=float(row[12]),
+                                                            parent_id=row[9]))
 
     def generate_truck(self, row: tuple) -> typing.Optional[DBTRS]:
-        if row[11] is not None and row[11]:
-            return DBTRS(id=row[11], gost=row[12], parent_id=row[15])
+        if row[2] is not None and row[2]:
+            return construct_trusted(DBTRS, id=row[2], gost=row[3], parent_id=row[6])
 
     def generate_trailer(self, row: tuple) -> typing.Optional[DBTRS]:
-        if row[13] is not None and row[13] != 0:
-            return DBTRS(id=row[13], gost=row[14], parent_id=row[16])
+        if row[4] is not None and row[4] != 0:
+            return construct_trusted(DBTRS, id=row[4], gost=row[5], parent_id=row[6])
 
     def generate_route(self, row: tuple) -> typing.Optional[DBMarsh]:
-        return DBMarsh(id=row[15], temperature_property=row[16], name=row[17],
-                       trailer=self.generate_trailer(row),
-                       truck=self.generate_truck(row), parent_id=row[0])
+        return construct_trusted(DBMarsh, id=row[6], temperature_property=MarshTemperatureProperty(row[7]),
+                                 name=row[8], parent_id=row[0],
+                                 trailer=self.generate_trailer(row), truck=self.generate_truck(row))
 
+    # Event rows: FETCH_EVENTS_FOR_TASKS columns
     def generate_event(self, row):
-        return DBEvent(id=row[22], type=row[23], text=row[24], parent_id=row[0], event_datetime=row[26],
-                       event_data=row[27])
-
-    def generate_task(self, row):
-        return DBAppTask(id=row[0], profile_id=row[1], start_pln=row[3], end_pln=row[4], start_fact=row[5],
-                         end_fact=row[6], status=row[7], task_type=row[8], text=row[9])
+        return construct_trusted(DBEvent, id=row[0], type=dictionary.lst_name(row[1]), text=row[2], parent_id=row[3],
+                                 event_data=RawJSON.from_stored(row[5] or "null"), event_datetime=row[4])
+
+    def generate_task_event(self, row):
+        return construct_trusted(DBTaskEvent, id=row[0], type=dictionary.lst_name(row[1]), text=row[2],
+                                 parent_id=row[3], event_data=RawJSON.from_stored(row[5] or "null"),
+                                 event_datetime=row[4],
+                                 task_id=row[3])
+
+    # Task rows: status and type are LST ids resolved through the dictionary
+    def generate_task(self, row, subtasks: list[DBSubTask], events: list[DBEvent],
+                      route: typing.Optional[DBMarsh]) -> DBAppTask:
+        return construct_trusted(DBAppTask, id=row[0], profile_id=row[1], start_pln=row[3], end_pln=row[4],
+                                 start_fact=row[5], end_fact=row[6], status=StatusEnum(dictionary.lst_name(row[7])),
+                                 task_type=TaskTypeEnum(dictionary.lst_name(row[8])), text=row[9],
+                                 events=events, subtasks=subtasks, route=route)
+
+    def generate_subtask(self, row, station: typing.Optional[DBMST]) -> DBSubTask:
+        return construct_trusted(DBSubTask, id=row[0], start_pln=row[3], end_pln=row[4], start_fact=row[5],
+                                 end_fact=row[6], status=StatusEnum(dictionary.lst_name(row[7])),
+                                 task_type=SubtaskTypeEnum(dictionary.lst_name(row[8])), text=row[9],
+                                 station=station)
+
+    def build_task_tree(self, task_rows: typing.Iterable[tuple], param_rows: typing.Iterable[tuple],
+                        event_rows: typing.Iterable[tuple]) -> list[DBAppTask]:
+        # Rows are first deduplicated by id and grouped by owner as plain tuples, then every model is built once,
+        # bottom-up, so nothing is assigned to a model after construction.
+        roots: dict[int, tuple] = {}
+        subtask_rows: dict[int, dict[int, tuple]] = {}
+        event_groups: dict[int, dict[int, tuple]] = {}
+        station_rows: dict[int, tuple] = {}
+        route_rows: dict[int, tuple] = {}
+
+        for row in task_rows:
+            task_id, parent_id = row[0], row[2]
+            if task_id == parent_id:
+                roots.setdefault(task_id, row)
+            else:
+                subtask_rows.setdefault(parent_id, {}).setdefault(task_id, row)
+
+        for row in param_rows:
+            if row[6] is not None:
+                route_rows.setdefault(row[0], row)
+            if row[9] is not None:
+                station_rows.setdefault(row[0], row)
+
+        for row in event_rows:
+            if row[0] is not None:
+                event_groups.setdefault(row[3], {}).setdefault(row[0], row)
+
+        tasks = []
+        for task_id, row in roots.items():
+            subtasks = [self.generate_subtask(r, self.generate_station(station_rows[r[0]])
+                                              if r[0] in station_rows else None)
+                        for r in sorted(subtask_rows.get(task_id, {}).values(), key=lambda u: u[3])]
+            events = [self.generate_event(r) for r in sorted(event_groups.get(task_id, {}).values(), key=lambda u: u[4])]
+            route = self.generate_route(route_rows[task_id]) if task_id in route_rows else None
+            tasks.append(self.generate_task(row, subtasks, events, route))
+
+        return sorted(tasks, key=lambda u: u.start_pln)
+
+    def fetch_task_relations(self, con: sqlalchemy.Connection, task_rows: typing.Sequence[tuple],
+                             with_events: bool = True) -> tuple[list[sqlalchemy.Row], list[sqlalchemy.Row]]:
+        task_ids = [row[0] for row in task_rows]
+        root_ids = [row[0] for row in task_rows if row[0] == row[2]]
+        param_rows = fetch_in_batches(con, _STMTS.FETCH_PARAMS_FOR_TASKS.value, task_ids, **param_tips())
+        event_rows = fetch_in_batches(con, _STMTS.FETCH_EVENTS_FOR_TASKS.value, root_ids) if with_events else []
+        return param_rows, event_rows
+
+    def fetch_scoped_tasks(self, stmt: TextClause, params: dict[str, typing.Any],
+                           with_events: bool = True) -> list[DBAppTask]:
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            task_rows = cur.execute(stmt, params).fetchall()
+            param_rows, event_rows = self.fetch_task_relations(cur, task_rows, with_events)
 
-    def generate_subtask(self, row):
-        return DBSubTask(id=row[0], parent_id=row[2], start_pln=row[3], end_pln=row[4], start_fact=row[5],
-                         end_fact=row[6], status=row[7], task_type=row[8], text=row[9])
+        return self.build_task_tree(task_rows, param_rows, event_rows)
 
     def fetch_tasks_with_subtasks(self, user_id: int) -> list[DBAppTask]:
-        stmt = _STMTS.FETCH_TASKS_WITH_SUBTASKS.value
+        return task_cache.fetch(user_id, lambda: self.load_tasks_with_subtasks(user_id))
+
+    def load_tasks_with_subtasks(self, user_id: int) -> list[DBAppTask]:
+        if Config.task_batched_loading:
+            return self.fetch_tasks_batched(user_id)
+        return self.fetch_tasks_joined(user_id)
+
+    def fetch_tasks_batched(self, user_id: int) -> list[DBAppTask]:
+        return self.fetch_scoped_tasks(_STMTS.FETCH_TASKS.value, {"user_id": user_id})
+
+    # Scoped reads are answered from the cached snapshot when there is one and go to the database otherwise
+
+    def fetch_tasks_by_status(self, user_id: int, status: StatusEnum) -> list[DBAppTask]:
+        snapshot = task_cache.get(user_id)
+        if snapshot is not None:
+            return [x for x in snapshot if x.status == status]
+        return self.fetch_scoped_tasks(_STMTS.FETCH_TASKS_BY_STATUS.value,
+                                       {"user_id": user_id, "status_id": dictionary.require_lst_id(status.value)})
+
+    # Counters always run the grouped COUNT: reading a cached snapshot would cost a Redis round trip and an unpickle
+    # of the whole tree per user
+
+    def count_tasks_by_status(self, user_id: int) -> dict[StatusEnum, int]:
         with self.get_session() as cur:
             cur: sqlalchemy.Connection
-            res = cur.execute(stmt, {"user_id": user_id}).fetchall()
+            rows = cur.execute(_STMTS.COUNT_TASKS_BY_STATUS.value, {"user_id": user_id}).fetchall()
+        return status_counts((StatusEnum(dictionary.lst_name(row[0])), row[1]) for row in rows)
+
+    def count_tasks_by_status_for_users(self, user_ids: typing.Iterable[int]) -> dict[int, dict[StatusEnum, int]]:
+        result = {user_id: status_counts() for user_id in user_ids}
+        if result:
+            with self.get_session() as cur:
+                cur: sqlalchemy.Connection
+                rows = fetch_in_batches(cur, _STMTS.COUNT_TASKS_BY_STATUS_FOR_USERS.value, list(result), key="user_ids")
+            for row in rows:
+                result[row[0]][StatusEnum(dictionary.lst_name(row[1]))] += row[2]
+        return result
+
+    def fetch_user_task(self, user_id: int, task_id: int, with_events: bool = True) -> typing.Optional[DBAppTask]:
+        snapshot = task_cache.get(user_id)
+        if snapshot is not None:
+            return next((x for x in snapshot if x.id == task_id), None)
+        tasks = self.fetch_scoped_tasks(_STMTS.FETCH_TASK_BY_ID.value, {"user_id": user_id, "task_id": task_id},
+                                        with_events)
+        return tasks[0] if tasks else None
+
+    def fetch_task_events(self, user_id: int, task_id: int, event_type: str) -> typing.Optional[list[DBEvent]]:
+        snapshot = task_cache.get(user_id)
+        if snapshot is not None:
+            task = next((x for x in snapshot if x.id == task_id), None)
+            return None if task is None else [x for x in task.events if x.type == event_type]
 
-            tasks = list(set(self.generate_task(row) for row in res if row[0] == row[2]))
-            for task in tasks:
-                task.subtasks = list(
-                    set(self.generate_subtask(row) for row in res if row[0] != row[2] and row[2] == task.id))
-                task.events = list(
-                    set(self.generate_event(row) for row in res if row[22] is not None and row[25] == task.id))
-                task.subtasks.sort(key=lambda u: u.start_pln)
-                task.events.sort(key=lambda u: u.event_datetime)
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            if cur.execute(_STMTS.CHECK_TASK_OWNER.value, {"user_id": user_id, "task_id": task_id}).fetchone() is None:
+                return None
+            rows = cur.execute(_STMTS.FETCH_TASK_EVENTS_BY_TYPE.value,
+                               {"task_id": task_id, "event_vid": dictionary.require_lst_id(event_type)}).fetchall()
+
+        return [self.generate_event(row) for row in rows]
+
+    # Keyset pages: a page costs the same however deep the cursor is, given an index on
+    # APP_TASK (APP_TASK_ID_SOTR, APP_TASK_DT_START_PLN, ID_APP_TASK)
+
+    def fetch_tasks_page(self, user_id: int, limit: int, cursor: str | None = None,
+                         status: StatusEnum | None = None) -> tuple[list[DBAppTask], str | None]:
+        after = decode_task_cursor(cursor)
+
+        snapshot = task_cache.get(user_id)
+        if snapshot is not None:
+            tasks = sorted((x for x in snapshot if status is None or x.status == status),
+                           key=lambda u: (u.start_pln, u.id))
+            if after is not None:
+                tasks = [x for x in tasks if (x.start_pln, x.id) > after]
+            return paginate(tasks, limit, task_cursor)
+
+        params = {"user_id": user_id, "limit": limit + 1}
+        if status is not None:
+            params["status_id"] = dictionary.require_lst_id(status.value)
+        if after is not None:
+            params["after_dt"], params["after_id"] = after
+        stmt = _STMTS[f"FETCH_TASK_PAGE{'_BY_STATUS' if status is not None else ''}{'_AFTER' if after else ''}"]
+
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            root_ids = [row[0] for row in cur.execute(stmt.value, params).fetchall()]
+            task_rows = fetch_in_batches(cur, _STMTS.FETCH_TASKS_FOR_ROOTS.value, root_ids[:limit])
+            param_rows, event_rows = self.fetch_task_relations(cur, task_rows)
+
+        tasks = sorted(self.build_task_tree(task_rows, param_rows, event_rows), key=lambda u: (u.start_pln, u.id))
+        return tasks, task_cursor(tasks[-1]) if len(root_ids) > limit and tasks else None
+
+    def fetch_task_events_page(self, user_id: int, task_id: int, event_type: str, limit: int,
+                               cursor: str | None = None) -> typing.Optional[tuple[list[DBEvent], str | None]]:
+        after = decode_event_cursor(cursor)
+
+        snapshot = task_cache.get(user_id)
+        if snapshot is not None:
+            task = next((x for x in snapshot if x.id == task_id), None)
+            if task is None:
+                return None
+            events = sorted((x for x in task.events if x.type == event_type and (after is None or x.id > after)),
+                            key=lambda u: u.id)
+            return paginate(events, limit, event_cursor)
+
+        params = {"task_id": task_id, "event_vid": dictionary.require_lst_id(event_type), "limit": limit + 1}
+        stmt = _STMTS.FETCH_TASK_EVENTS_PAGE
+        if after is not None:
+            params["after_id"] = after
+            stmt = _STMTS.FETCH_TASK_EVENTS_PAGE_AFTER
 
-                for subtask in task.subtasks:
-                    subtask.station = next(self.generate_station(row) for row in res if
-                                           row[18] is not None and row[0] == subtask.id)
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            if cur.execute(_STMTS.CHECK_TASK_OWNER.value, {"user_id": user_id, "task_id": task_id}).fetchone() is None:
+                return None
+            rows = cur.execute(stmt.value, params).fetchall()
+
+        return paginate([self.generate_event(row) for row in rows], limit, event_cursor)
+
+    def fetch_tasks_delta(self, user_id: int, since: str | None = None) -> DBTaskDelta:
+        # Without a watermark the whole tree is sent; afterwards only rows from the watermark on are read, which is an
+        # index range on ID_APP_EVENT and APP_TASK_CH. Generator ids and change times are taken before commit, so a
+        # row committed after the last sync may sort below its watermark: each delta re-reads an overlap window below
+        # the watermark and clients de-duplicate by id.
+        # Param changes and edited or deleted events move neither watermark, and rows committed later than the window
+        # are missed too, so the whole tree is sent again with `resync` once task_delta_resync_interval has passed
+        # since the last whole-tree sync
+        watermark = decode_watermark(since)
+        resync = watermark is None or time.time() - watermark[2] > Config.task_delta_resync_interval
+
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            if resync:
+                # The watermark is read before the tree, so nothing changed in between is skipped by the next delta
+                event_id, changed_at = cur.execute(_STMTS.FETCH_SYNC_WATERMARK.value, {"user_id": user_id}).fetchone()
+                synced_at = time.time()
+                task_rows = cur.execute(_STMTS.FETCH_TASKS.value, {"user_id": user_id}).fetchall()
+                changed_rows, new_event_rows = [], []
+            else:
+                event_id, changed_at, synced_at = watermark
+                since_ch = changed_at - datetime.timedelta(seconds=Config.task_delta_change_overlap)
+                since_event = max(event_id - Config.task_delta_event_overlap, 0)
+                changed_rows = cur.execute(_STMTS.FETCH_CHANGED_TASKS.value,
+                                           {"user_id": user_id, "since_ch": since_ch}).fetchall()
+                new_event_rows = cur.execute(_STMTS.FETCH_NEW_EVENTS.value,
+                                             {"user_id": user_id, "since_event": since_event}).fetchall()
+                root_ids = {row[1] for row in changed_rows}
+                task_rows = fetch_in_batches(cur, _STMTS.FETCH_TASKS_FOR_ROOTS.value, sorted(root_ids))
+            param_rows, event_rows = self.fetch_task_relations(cur, task_rows)
+
+        tasks = self.build_task_tree(task_rows, param_rows, event_rows)
+        sent = {task.id for task in tasks}
+        event_id = max([event_id or 0, *(row[0] for row in new_event_rows)])
+        changed_at = max([changed_at or SYNC_EPOCH, *(row[3] for row in changed_rows if row[3] is not None)])
+
+        return DBTaskDelta(tasks=tasks,
+                           events=[self.generate_task_event(row) for row in new_event_rows if row[3] not in sent],
+                           deleted_task_ids=sorted(row[0] for row in changed_rows
+                                                   if row[0] == row[1] and row[0] not in sent),
+                           resync=resync,
+                           watermark=encode_watermark(event_id, changed_at, synced_at))
+
+    def fetch_tasks_joined(self, user_id: int) -> list[DBAppTask]:
+        stmt = _STMTS.FETCH_TASKS_WITH_SUBTASKS.value
+        with self.get_session() as cur:
+            cur: sqlalchemy.Connection
+            res = cur.execute(stmt, {"user_id": user_id, **param_tips()}).fetchall()
 
-                task.route = next(self.generate_route(row) for row in res if row[0] == task.id and row[15] is not None)
+        return self.build_task_tree(*self.split_joined_rows(res))
 
-            tasks.sort(key=lambda u: u.start_pln)
-            return tasks
+    @staticmethod
+    def split_joined_rows(res: typing.Sequence[tuple]) -> tuple[typing.Sequence[tuple], list[tuple], list[tuple]]:
+        # Split joined rows into the task, param and event layouts used by the batched statements
+        return res, [row[:1] + row[10:22] for row in res], [row[22:28] for row in res]
 
     @deprecated("DEPRECATED: use fetch_tasks_with_subtasks instead")
     def fetch_task_by_id(self, task_id: int) -> typing.Optional[DBAppTask]:
@@ -209,19 +659,25 @@ t1.APP_TASK_ID_SOTR = :user_id;
                           start_fact=row[5], end_fact=row[6], status=row[7], task_type=row[8], text=row[9]) for row
                 in res]
 
-    def update_task(self, event: UpdTaskData, profile_id: int):
-        with self.get_session() as session:
-            session: sqlalchemy.Connection
-
-            status_id = session.execute(text("""
-            select first 1 ID_LST from LST where LST_NAME_SH = :status_val and LST_DEL = 0 
-            """), {"status_val": event.status.value}).fetchone()[0]
-
-            data = {"8794": f"{status_id}"}
+    def update_tasks(self, events: typing.Sequence[UpdTaskData], profile_id: int,
+                     root_task_ids: typing.Container[int]):
+        # All events of a chain are inserted with one executemany in one transaction
+        params = []
+        for event in events:
+            data = {"8794": f"{dictionary.require_lst_id(event.status.value)}"}
 
             if event.status == StatusEnum.CANCELLED:
                 data["error"] = event.error_text
 
-            session.execute(*generate_event_stmt(profile_id, event.task_id, event.dt,
-                                                 f"Установлен новый статус {"задачи" if self.fetch_task_by_id(event.task_id) else "подзадачи"}: {event.status.value}", event_data=data))
+            kind = "задачи" if event.task_id in root_task_ids else "подзадачи"
+            params.append(generate_event_stmt(profile_id, event.task_id, event.dt,
+                                              f"Установлен новый статус {kind}: {event.status.value}",
+                                              event_data=data)[1])
+
+        if not params:
+            return
+        with self.get_session() as session:
+            session: sqlalchemy.Connection
+            session.execute(_STMTS.INSERT_EVENT.value, params)
             session.commit()
+        task_cache.invalidate(profile_id)
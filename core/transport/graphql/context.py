@@ -0,0 +1,55 @@
+import typing
+
+from strawberry.dataloader import DataLoader
+from strawberry.fastapi import BaseContext
+
+from core.model.task.db import DBAppTask, DBSubTask
+from core.model.task.enums import StatusEnum
+from core.storage import async_task_storage
+from core.storage.task_storage import IN_BATCH_SIZE
+from core.transport.graphql.db_schema import load_pric, load_auto
+
+
+async def load_tasks(user_ids: list[int]) -> list[list[DBAppTask]]:
+    return [await async_task_storage.fetch_tasks_with_subtasks(user_id) for user_id in user_ids]
+
+
+async def load_task_counts(user_ids: list[int]) -> list[dict[StatusEnum, int]]:
+    counts = await async_task_storage.count_tasks_by_status_for_users(user_ids)
+    return [counts[user_id] for user_id in user_ids]
+
+
+class Context(BaseContext):
+    """
+    Per-request GraphQL context.
+
+    DataLoaders live here so that keys collected by one resolver tier are fetched with one statement and results are
+    never shared between requests. The task snapshot of a user is loaded once per operation, however many root
+    fields select it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pric_loader = DataLoader(load_pric, max_batch_size=IN_BATCH_SIZE)
+        self.auto_loader = DataLoader(load_auto, max_batch_size=IN_BATCH_SIZE)
+        self.tasks_loader = DataLoader(load_tasks)
+        self.task_counts_loader = DataLoader(load_task_counts, max_batch_size=IN_BATCH_SIZE)
+        self._active_subtasks: dict[int, typing.Optional[DBSubTask]] = {}
+
+    async def tasks(self, user_id: int) -> list[DBAppTask]:
+        return await self.tasks_loader.load(user_id)
+
+    async def task_counts(self, user_id: int) -> dict[StatusEnum, int]:
+        return await self.task_counts_loader.load(user_id)
+
+    def active_subtask(self, task: DBAppTask) -> typing.Optional[DBSubTask]:
+        try:
+            return self._active_subtasks[task.id]
+        except KeyError:
+            subtask = next((x for x in task.subtasks if x.status == StatusEnum.IN_PROGRESS), None)
+            self._active_subtasks[task.id] = subtask
+            return subtask
+
+
+async def get_context() -> Context:
+    return Context()
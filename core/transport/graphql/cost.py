@@ -0,0 +1,144 @@
+import logging
+import typing
+
+from graphql import (FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, GraphQLInterfaceType,
+                     GraphQLObjectType, GraphQLSchema, InlineFragmentNode, IntValueNode, OperationDefinitionNode,
+                     SelectionSetNode, VariableNode, get_named_type, get_nullable_type, is_list_type,
+                     value_from_ast_untyped)
+from strawberry.extensions import SchemaExtension
+
+from core.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Cost of resolving a field itself, by "Type.field". Fields batched through the request DataLoaders cost more than
+# plain fields; other object fields cost COMPOSITE_FIELD_COST and scalars nothing
+FIELD_COSTS: dict[str, int] = {
+    "Query.countPlannedTasks": 2,
+    "Query.countCompletedTasks": 2,
+    "Query.taskCounters": 2,
+    "MARSH.pric": 2,
+    "MARSH.auto": 2,
+    "Mutation.addEvent": 10,
+}
+# Fields that load from storage, by "Type.field": (load, arguments that identify it, cost). A load is charged once
+# per operation for each distinct set of its arguments, as the request shares it between aliases; every further
+# alias costs COMPOSITE_FIELD_COST. The task fields share the snapshot of a user
+LOAD_COSTS: dict[str, tuple[str, tuple[str, ...] | None, int]] = {
+    "Query.tasks": ("snapshot", ("userId",), 200),
+    "Query.task": ("snapshot", ("userId",), 200),
+    "Query.subtask": ("snapshot", ("userId",), 200),
+    "Query.subtasks": ("snapshot", ("userId",), 200),
+    "Query.tasksDelta": ("tasksDelta", None, 200),
+    "Query.notes": ("notes", None, 50),
+    "DB.appEvent": ("appEvent", None, 100),
+    "DB.param": ("param", None, 100),
+}
+COMPOSITE_FIELD_COST = 1
+# Assumed length of a list field without a `limit` argument; the cost of its selection is multiplied by it
+DEFAULT_LIST_SIZE = 10
+
+
+def operation_cost(schema: GraphQLSchema, operation: OperationDefinitionNode,
+                   fragments: dict[str, FragmentDefinitionNode], variables: dict[str, typing.Any] | None) -> int:
+    root = schema.get_root_type(operation.operation)
+    return _selection_cost(schema, root, operation.selection_set, fragments, variables or {}, frozenset(), set())
+
+
+def _selection_cost(schema, parent_type, selection_set: SelectionSetNode, fragments, variables, spread,
+                    loads: set) -> int:
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            cost += _field_cost(schema, parent_type, selection, fragments, variables, spread, loads)
+        elif isinstance(selection, InlineFragmentNode):
+            type_ = schema.get_type(selection.type_condition.name.value) if selection.type_condition else parent_type
+            cost += _selection_cost(schema, type_, selection.selection_set, fragments, variables, spread, loads)
+        elif isinstance(selection, FragmentSpreadNode):
+            # The document is not validated yet, so unknown and cyclic fragments are skipped here
+            fragment = fragments.get(selection.name.value)
+            if fragment is None or fragment.name.value in spread:
+                continue
+            cost += _selection_cost(schema, schema.get_type(fragment.type_condition.name.value),
+                                    fragment.selection_set, fragments, variables, spread | {fragment.name.value},
+                                    loads)
+    return cost
+
+
+def _field_cost(schema, parent_type, node: FieldNode, fragments, variables, spread, loads: set) -> int:
+    if not isinstance(parent_type, (GraphQLObjectType, GraphQLInterfaceType)):
+        return 0
+    field = parent_type.fields.get(node.name.value)
+    if field is None:
+        return 0
+
+    name = f"{parent_type.name}.{node.name.value}"
+    cost = FIELD_COSTS.get(name)
+    if name in LOAD_COSTS:
+        load, arguments, load_cost = LOAD_COSTS[name]
+        key = (load, _argument_values(node, arguments, variables))
+        cost = COMPOSITE_FIELD_COST if key in loads else load_cost
+        loads.add(key)
+    if node.selection_set is None:
+        return cost or 0
+    if cost is None:
+        cost = COMPOSITE_FIELD_COST
+
+    children = _selection_cost(schema, get_named_type(field.type), node.selection_set, fragments, variables, spread,
+                               loads)
+    if is_list_type(get_nullable_type(field.type)):
+        children *= _list_size(node, variables)
+    return cost + children
+
+
+def _argument_values(node: FieldNode, names: tuple[str, ...] | None, variables: dict[str, typing.Any]) -> str:
+    values = {x.name.value: value_from_ast_untyped(x.value, variables) for x in node.arguments
+              if names is None or x.name.value in names}
+    return repr(sorted(values.items()))
+
+
+def _list_size(node: FieldNode, variables: dict[str, typing.Any]) -> int:
+    for argument in node.arguments:
+        if argument.name.value != "limit":
+            continue
+        if isinstance(argument.value, IntValueNode):
+            return int(argument.value.value)
+        if isinstance(argument.value, VariableNode) and isinstance(variables.get(argument.value.name.value), int):
+            return variables[argument.value.name.value]
+    return DEFAULT_LIST_SIZE
+
+
+class QueryCostLimiter(SchemaExtension):
+    """
+    Static cost analysis of GraphQL operations.
+
+    The cost is computed from the document before validation, operations over `max_cost` are rejected before
+    anything is executed. The computed cost is reported in the `cost` response extension, or in the extensions of
+    the error for rejected operations. Registered as a class, so every operation gets its own instance.
+    """
+    max_cost: int = Config.graphql_max_cost
+
+    cost: int | None = None
+
+    def on_validate(self):
+        context = self.execution_context
+        document = context.graphql_document
+        operation = next((x for x in document.definitions if isinstance(x, OperationDefinitionNode) and (
+                context.operation_name is None or x.name is not None and x.name.value == context.operation_name)),
+                         None) if document is not None else None
+
+        # Validation errors found by an earlier extension are kept as they are
+        if operation is not None and not context.errors:
+            fragments = {x.name.value: x for x in document.definitions if isinstance(x, FragmentDefinitionNode)}
+            self.cost = operation_cost(context.schema._schema, operation, fragments, context.variables)
+            if self.cost > self.max_cost:
+                logger.warning("Rejected GraphQL operation %s with cost %s", context.operation_name, self.cost)
+                # Errors set before validation stop the operation the same way validation errors do
+                context.errors = [GraphQLError(f"Query cost {self.cost} exceeds the maximum cost of {self.max_cost}",
+                                               extensions={"cost": self.cost, "maxCost": self.max_cost})]
+        yield
+
+    def get_results(self) -> dict[str, typing.Any]:
+        if self.cost is None:
+            return {}
+        return {"cost": {"requested": self.cost, "maximum": self.max_cost}}
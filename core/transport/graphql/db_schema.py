@@ -1,10 +1,15 @@
+import functools
 from dataclasses import dataclass
 from typing import Optional, TypeVar, Any, NewType, TypedDict
 
 import strawberry
-from sqlalchemy import text, CursorResult, Sequence, Row, TextClause
+from sqlalchemy import text, bindparam, CursorResult, Sequence, Row, TextClause
+from strawberry.schema.name_converter import NameConverter
+from strawberry.types.nodes import SelectedField, Selection
 
-from core.storage import base_storage
+from core.storage import base_storage, run_in_storage_executor
+from core.storage.base import row_mapper
+from core.storage.task_storage import param_tips
 
 T = TypeVar("T")
 
@@ -16,17 +21,76 @@ class EXEC_STATEMENT:
 
 
 def return_strawberry_model(model: type[T], rows: CursorResult, data: Sequence[Row]) -> list[T]:
-    return [model(**{rows._metadata.keys._keys[idx].upper(): elem for idx, elem in enumerate(row) if
-                     rows._metadata.keys._keys[idx].upper() in model.__annotations__}) for row in data]
+    build = row_mapper(model, tuple(rows.keys()))
+    return [build(row) for row in data]
 
 
-def exec_statement(stmt: TextClause, **kwargs) -> EXEC_STATEMENT:
+def _exec_statement(stmt: TextClause, kwargs: dict[str, Any]) -> EXEC_STATEMENT:
     with base_storage.get_session() as session:
         rows = session.execute(stmt, kwargs)
         data = rows.fetchall()
     return EXEC_STATEMENT(rows, data)
 
 
+async def exec_statement(stmt: TextClause, **kwargs) -> EXEC_STATEMENT:
+    return await run_in_storage_executor(_exec_statement, stmt, kwargs)
+
+
+async def load_by_key(stmt: TextClause, model: type[T], keys: list[int]) -> list[Optional[T]]:
+    # The first column of `stmt` is the key; the first row of each key wins
+    d = await exec_statement(stmt, ids=list(set(keys)))
+    found: dict[int, T] = {}
+    for row, obj in zip(d.data, return_strawberry_model(model, d.rows, d.data)):
+        found.setdefault(row[0], obj)
+    return [found.get(key) for key in keys]
+
+
+def selected_names(selections: list[Selection]) -> dict[str, list[Selection]]:
+    # GraphQL field name -> sub-selections of all its occurrences, fragments are flattened
+    result: dict[str, list[Selection]] = {}
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            result.setdefault(selection.name, []).extend(selection.selections)
+        else:
+            for name, children in selected_names(selection.selections).items():
+                result.setdefault(name, []).extend(children)
+    return result
+
+
+@functools.cache
+def column_fields(converter: NameConverter, model: type) -> dict[str, str]:
+    # GraphQL name -> column of the fields of `model` that are read from a table column
+    return {converter.get_graphql_name(field): field.python_name for field in model.__strawberry_definition__.fields
+            if field.base_resolver is None}
+
+
+def projection(info: strawberry.Info, model: type, selections: dict[str, list[Selection]],
+               required: tuple[str, ...] = ()) -> tuple[str, ...]:
+    # Columns to read for the selected fields of `model`, `required` first; never empty. Unread columns are left
+    # empty on the built objects, as they are never resolved
+    fields = column_fields(info.schema.config.name_converter, model)
+    columns = dict.fromkeys(required)
+    columns.update((fields[name], None) for name in selections if name in fields)
+    return tuple(columns) or (next(iter(fields.values())),)
+
+
+# Batched relation statements, `:ids` are the keys collected by the DataLoaders of one request
+FETCH_PRIC_BY_MARSH = text("""
+select mt.MARSH_TRS_ID_MARSH, t.ID_TRS, t.TRS_SID_GOST from TRS t join MARSH_TRS mt on mt.MARSH_TRS_ID_PRIC = t.ID_TRS where mt.MARSH_TRS_ID_MARSH in :ids
+""").bindparams(bindparam("ids", expanding=True))
+FETCH_AUTO_BY_MARSH = text("""
+select mt.MARSH_TRS_ID_MARSH, t.ID_TRS, t.TRS_SID_GOST from TRS t join MARSH_TRS mt on mt.MARSH_TRS_ID_TRS = t.ID_TRS where mt.MARSH_TRS_ID_MARSH in :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+
+async def load_pric(keys: list[int]) -> list[Optional['TRS']]:
+    return await load_by_key(FETCH_PRIC_BY_MARSH, TRS, keys)
+
+
+async def load_auto(keys: list[int]) -> list[Optional['TRS']]:
+    return await load_by_key(FETCH_AUTO_BY_MARSH, TRS, keys)
+
+
 @strawberry.type
 class LST:
     ID_LST: str
@@ -58,25 +122,13 @@ class MARSH:
     MARSH_PR_TEPL: int
     MARSH_NAME: str
 
-    def get_trs(self, stmt):
-        d = exec_statement(stmt, id_marsh=int(self.ID_MARSH))
-        if len(d.data) == 0:
-            return
-        return return_strawberry_model(TRS, d.rows, d.data)[0]
-
     @strawberry.field
-    def pric(self) -> Optional[TRS]:
-        stmt = text("""
-        select t.ID_TRS, t.TRS_SID_GOST from TRS t join MARSH_TRS mt on mt.MARSH_TRS_ID_PRIC = t.ID_TRS where mt.MARSH_TRS_ID_MARSH = :id_marsh
-        """)
-        return self.get_trs(stmt)
+    async def pric(self, info: strawberry.Info) -> Optional[TRS]:
+        return await info.context.pric_loader.load(int(self.ID_MARSH))
 
     @strawberry.field
-    def auto(self) -> Optional[TRS]:
-        stmt = text("""
-        select t.ID_TRS, t.TRS_SID_GOST from TRS t join MARSH_TRS mt on mt.MARSH_TRS_ID_TRS = t.ID_TRS where mt.MARSH_TRS_ID_MARSH = :id_marsh
-        """)
-        return self.get_trs(stmt)
+    async def auto(self, info: strawberry.Info) -> Optional[TRS]:
+        return await info.context.auto_loader.load(int(self.ID_MARSH))
 
 
 @strawberry.type
@@ -86,27 +138,16 @@ class APP_PARAM:
     APP_PARAM_TIP: int
 
 
+    # marsh and mst are read together with the param by DB.param, the only place params are built
+    joined: strawberry.Private[Optional[dict[str, Any]]] = None
+
     @strawberry.field
     def marsh(self) -> Optional[MARSH]:
-
-        if self.APP_PARAM_TIP != 8750:
-            return
-        stmt = text("""
-            select m.ID_MARSH, m.MARSH_PR_TEPL, m.MARSH_NAME from MARSH m join MARSH_TRS mt on m.ID_MARSH = mt.MARSH_TRS_ID_MARSH where ID_MARSH_TRS = :id_marsh_trs 
-        """)
-        d = exec_statement(stmt, id_marsh_trs=int(self.APP_PARAM_STR))
-        return return_strawberry_model(MARSH, d.rows, d.data)[0]
+        return self.joined.get("marsh") if self.joined else None
 
     @strawberry.field
     def mst(self) -> Optional[MST]:
-
-        if self.APP_PARAM_TIP not in [8668]:
-            return
-        stmt = text(f"""
-        select ID_MST, MST_NAME, MST_SHIR, MST_DOLG from MST where ID_MST = :id_mst
-        """)
-        d = exec_statement(stmt, id_mst=int(self.APP_PARAM_STR))
-        return return_strawberry_model(MST, d.rows, d.data)[0]
+        return self.joined.get("mst") if self.joined else None
 
 
 @strawberry.type
@@ -122,36 +163,76 @@ class APP_EVENT:
     APP_EVENT_DT: str
 
 
+@functools.lru_cache(maxsize=256)
+def app_event_stmt(columns: tuple[str, ...]) -> TextClause:
+    return text(f"select {', '.join(columns)} from APP_EVENT where APP_EVENT_ID_SOTR = :user_id")
+
+
+@functools.lru_cache(maxsize=256)
+def param_stmt(param_columns: tuple[str, ...], marsh_columns: tuple[str, ...], mst_columns: tuple[str, ...],
+               by_user: bool) -> TextClause:
+    # Params of a user or of a record, with the marsh and mst joined in when they are selected; the param kinds are
+    # bound from param_tips(), as in the REST task statements
+    columns = [f"p.{x}" for x in param_columns] + [f"m.{x}" for x in marsh_columns] + [f"mst.{x}" for x in mst_columns]
+    joins = []
+    if by_user:
+        joins.append("join APP_TASK t on t.ID_APP_TASK = p.APP_PARAM_ID_REC")
+    if marsh_columns:
+        joins.append("left join MARSH_TRS mt on p.APP_PARAM_STR = mt.ID_MARSH_TRS and p.APP_PARAM_TIP = :marsh_trs_tip")
+        joins.append("left join MARSH m on m.ID_MARSH = mt.MARSH_TRS_ID_MARSH")
+    if mst_columns:
+        joins.append("left join MST mst on p.APP_PARAM_STR = mst.ID_MST and p.APP_PARAM_TIP = :mst_tip")
+    where = "t.APP_TASK_ID_SOTR = :id_sotr" if by_user else "p.APP_PARAM_ID_REC = :id_rec"
+    return text(f"select {', '.join(columns)} from APP_PARAM p {' '.join(joins)} where {where}")
+
+
 @strawberry.type
 class DB:
 
     @strawberry.field
-    def app_event(self, user_id: str) -> list[APP_EVENT]:
-        stmt = text("select  * from APP_EVENT where APP_EVENT_ID_SOTR = :user_id")
-        d = exec_statement(stmt, user_id=user_id)
-        return return_strawberry_model(APP_EVENT, d.rows, d.data)
+    async def app_event(self, info: strawberry.Info, user_id: str) -> list[APP_EVENT]:
+        columns = projection(info, APP_EVENT, selected_names(info.selected_fields[0].selections))
+        d = await exec_statement(app_event_stmt(columns), user_id=user_id)
+        build = row_mapper(APP_EVENT, columns, fill_missing=True)
+        return [build(row) for row in d.data]
 
     @strawberry.field
-    def param(self, info: strawberry.Info, user_id: Optional[str] = None, id_rec: Optional[str] = None) -> list[
+    async def param(self, info: strawberry.Info, user_id: Optional[str] = None, id_rec: Optional[str] = None) -> list[
         APP_PARAM]:
 
         if all(x is None for x in [user_id, id_rec]):
             raise Exception("Argument error. userId or idRec should be provided.")
+
+        # Only the selected columns are read; a selected marsh or mst is joined in rather than loaded per param
+        selections = selected_names(info.selected_fields[0].selections)
+        marsh_columns = mst_columns = ()
+        if "marsh" in selections:
+            marsh_columns = projection(info, MARSH, selected_names(selections["marsh"]), ("ID_MARSH",))
+        if "mst" in selections:
+            mst_columns = projection(info, MST, selected_names(selections["mst"]), ("ID_MST",))
+        param_columns = projection(info, APP_PARAM, selections,
+                                   ("APP_PARAM_TIP", "APP_PARAM_STR") if marsh_columns or mst_columns else ())
+
+        stmt = param_stmt(param_columns, marsh_columns, mst_columns, by_user=user_id is not None)
+        tips = param_tips() if marsh_columns or mst_columns else {}
         if user_id is not None:
-            stmt = text(
-                "select p.* from APP_PARAM p join APP_TASK t on t.ID_APP_TASK = p.APP_PARAM_ID_REC where t.APP_TASK_ID_SOTR = :id_sotr")
-            d = exec_statement(stmt, id_sotr=int(user_id))
+            d = await exec_statement(stmt, id_sotr=int(user_id), **tips)
         else:
-            stmt = text("select * from APP_PARAM where APP_PARAM_ID_REC = :id_rec")
-            d = exec_statement(stmt, id_rec=int(id_rec))
-        returned_list = return_strawberry_model(APP_PARAM, d.rows, d.data)
-
-        # selections = info.selected_fields[0].selections
-        # db_selected_fields = ["p.*"]
-        #
-        # # Get selection List of field
-        # if 'marsh' in [x.name for x in selections]:
-        #     sub_query = "join MARSH_TRS mt on cast(p.APP_PARAM_STR as d_bigint) = mt.ID_MARSH_TRS join MARSH m on m.ID_MARSH = mt.MARSH_TRS_ID_MARSH"
-        #     db_selected_fields.extend("m." + x for x in MARSH.__annotations__ if MARSH.__annotations__[x] in [str, int])
+            d = await exec_statement(stmt, id_rec=int(id_rec), **tips)
+
+        marsh_at = len(param_columns)
+        mst_at = marsh_at + len(marsh_columns)
+        build_param = row_mapper(APP_PARAM, param_columns, fill_missing=True)
+        build_marsh = row_mapper(MARSH, marsh_columns, fill_missing=True)
+        build_mst = row_mapper(MST, mst_columns, fill_missing=True)
+        returned_list = []
+        for row in d.data:
+            param = build_param(row)
+            param.joined = {}
+            if marsh_columns:
+                param.joined["marsh"] = build_marsh(row[marsh_at:mst_at]) if row[marsh_at] is not None else None
+            if mst_columns:
+                param.joined["mst"] = build_mst(row[mst_at:]) if row[mst_at] is not None else None
+            returned_list.append(param)
 
         return returned_list
@@ -1,5 +1,5 @@
-from strawberry.fastapi import GraphQLRouter
-
+from core.transport.graphql.context import get_context
+from core.transport.graphql.persisted import PersistedQueryRouter
 from core.transport.graphql.schema import schema
 
-router = GraphQLRouter(schema=schema)
+router = PersistedQueryRouter(schema=schema, context_getter=get_context)
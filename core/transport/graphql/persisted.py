@@ -0,0 +1,140 @@
+import collections
+import hashlib
+import json
+import logging
+import threading
+import typing
+
+from graphql import GraphQLError
+from redis import StrictRedis
+from redis.exceptions import RedisError
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLRequestData
+from strawberry.types import ExecutionResult
+
+from core.config import Config
+from core.database.db import redis_client
+from core.storage import run_in_cache_executor
+
+logger = logging.getLogger(__name__)
+
+
+class PersistedQueryNotFound(Exception):
+    pass
+
+
+class PersistedQueryMismatch(Exception):
+    pass
+
+
+class PersistedQueryStore:
+    """
+    sha256 hash -> GraphQL document, for automatic persisted queries.
+
+    Documents are kept in a bounded in-process LRU in front of Redis, so every instance learns a document
+    registered on any of them. Redis is optional: when it is unavailable clients just register again.
+    """
+    KEY_PREFIX = "mp_driver:graphql:apq"
+
+    def __init__(self, client: StrictRedis, ttl: int, local_size: int):
+        self.client = client
+        self.ttl = ttl
+        self.local_size = local_size
+
+        self._local: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, digest: str) -> str:
+        return f"{self.KEY_PREFIX}:{digest}"
+
+    def get_local(self, digest: str) -> typing.Optional[str]:
+        with self._lock:
+            query = self._local.get(digest)
+            if query is not None:
+                self._local.move_to_end(digest)
+            return query
+
+    def get(self, digest: str) -> typing.Optional[str]:
+        query = self.get_local(digest)
+        if query is not None:
+            return query
+
+        try:
+            query = self.client.get(self.key(digest))
+        except RedisError as exc:
+            logger.warning("Persisted query store is unavailable: %s", exc)
+            return None
+        if query is not None:
+            self._store_local(digest, query)
+        return query
+
+    def put(self, digest: str, query: str):
+        self._store_local(digest, query)
+        try:
+            self.client.set(self.key(digest), query, ex=self.ttl)
+        except RedisError as exc:
+            logger.warning("Persisted query store is unavailable: %s", exc)
+
+    def _store_local(self, digest: str, query: str):
+        with self._lock:
+            self._local[digest] = query
+            self._local.move_to_end(digest)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+
+persisted_queries = PersistedQueryStore(redis_client, ttl=Config.graphql_persisted_query_ttl,
+                                        local_size=Config.graphql_persisted_query_local_size)
+
+
+class PersistedQueryRouter(GraphQLRouter):
+    """
+    GraphQL router speaking the automatic persisted queries protocol.
+
+    A request may carry `extensions.persistedQuery.sha256Hash` instead of the query. An unknown hash is answered with
+    a PersistedQueryNotFound error, after which the client sends the query together with its hash once.
+    """
+
+    def should_render_graphql_ide(self, request) -> bool:
+        # GET requests carrying only a persisted query hash have no `query` either
+        return super().should_render_graphql_ide(request) and "extensions" not in request.query_params
+
+    async def parse_http_body(self, request) -> GraphQLRequestData:
+        content_type = request.content_type or ""
+        if request.method == "GET":
+            data = self.parse_query_params(request.query_params)
+            if isinstance(data.get("extensions"), str):
+                data["extensions"] = json.loads(data["extensions"])
+        elif "application/json" in content_type:
+            data = self.parse_json(await request.get_body())
+        else:
+            return await super().parse_http_body(request)
+
+        query = data.get("query")
+        extensions = data.get("extensions")
+        persisted = extensions.get("persistedQuery") if isinstance(extensions, dict) else None
+        if isinstance(persisted, dict) and persisted.get("version") == 1:
+            digest = str(persisted.get("sha256Hash", "")).lower()
+            if query is None:
+                query = persisted_queries.get_local(digest)
+                if query is None:
+                    # A stalled Redis counts as a miss, the client then sends the query along
+                    query = await run_in_cache_executor(persisted_queries.get, digest)
+                if query is None:
+                    raise PersistedQueryNotFound()
+            elif hashlib.sha256(query.encode()).hexdigest() != digest:
+                raise PersistedQueryMismatch()
+            elif persisted_queries.get_local(digest) is None:
+                await run_in_cache_executor(persisted_queries.put, digest, query)
+
+        return GraphQLRequestData(query=query, variables=data.get("variables"),
+                                  operation_name=data.get("operationName"))
+
+    async def execute_operation(self, request, context, root_value) -> ExecutionResult:
+        try:
+            return await super().execute_operation(request, context, root_value)
+        except PersistedQueryNotFound:
+            error = GraphQLError("PersistedQueryNotFound", extensions={"code": "PERSISTED_QUERY_NOT_FOUND"})
+        except PersistedQueryMismatch:
+            error = GraphQLError("provided sha does not match query", extensions={"code": "BAD_USER_INPUT"})
+        return ExecutionResult(data=None, errors=[error])
@@ -2,18 +2,24 @@ import json
 import typing
 
 from core.model.note.db import AppNoteDB
-from core.model.task.db import DBAppTask, DBSubTask, DBEvent, DBMarsh, DBTRS, DBMST, Location
+from core.model.task.db import DBAppTask, DBSubTask, DBEvent, DBMarsh, DBTRS, DBMST, Location, DBTaskEvent, \
+    DBTaskDelta
 
 from datetime import datetime
 from enum import Enum
 
 import strawberry
+from strawberry.extensions import QueryDepthLimiter, ParserCache, ValidationCache
 from strawberry.types import Info
 from sqlalchemy import select, text, insert, TableClause, ColumnClause
 
+from core.config import Config
+from core.helpers.pagination import page_size, task_cursor
 from core.model.task.db2 import MPAppEventDB
 from core.model.task.enums import StatusEnum
-from core.storage import base_storage, task_storage, note_storage
+from core.storage import base_storage, async_task_storage, async_note_storage, task_cache, run_in_storage_executor
+from core.storage.base import row_mapper
+from core.transport.graphql.cost import QueryCostLimiter
 from core.transport.graphql.db_schema import DB, APP_EVENT
 
 
@@ -52,9 +58,16 @@ class Query:
         return DB()
 
     @strawberry.field
-    def tasks(self, user_id: str, is_planned: typing.Optional[bool] = False,
-              is_completed: typing.Optional[bool] = False) -> list['AppTaskQL']:
-        tasks = task_storage.fetch_tasks_with_subtasks(user_id)
+    async def tasks(self, info: Info, user_id: str, is_planned: typing.Optional[bool] = False,
+                    is_completed: typing.Optional[bool] = False, limit: typing.Optional[int] = None,
+                    cursor: typing.Optional[str] = None) -> list['AppTaskQL']:
+        # Paged when limit or cursor is given; the next page starts after the `cursor` of the last task
+        if limit is not None or cursor is not None:
+            status = StatusEnum.NOT_DEFINED if is_planned else StatusEnum.COMPLETED if is_completed else None
+            tasks, _ = await async_task_storage.fetch_tasks_page(int(user_id), page_size(limit), cursor, status=status)
+            return tasks
+
+        tasks = await info.context.tasks(int(user_id))
 
         if is_planned:
             return [x for x in tasks if x.status == StatusEnum.NOT_DEFINED]
@@ -64,10 +77,13 @@ class Query:
         return tasks
 
     @strawberry.field
-    def task(self, user_id: str, task_id: typing.Optional[str] = None, is_active: typing.Optional[bool] = None) -> \
-            typing.Optional[
-                'AppTaskQL']:
-        tasks = task_storage.fetch_tasks_with_subtasks(user_id)
+    async def tasks_delta(self, user_id: str, since: typing.Optional[str] = None) -> 'TaskDeltaQL':
+        return await async_task_storage.fetch_tasks_delta(int(user_id), since)
+
+    @strawberry.field
+    async def task(self, info: Info, user_id: str, task_id: typing.Optional[str] = None,
+                   is_active: typing.Optional[bool] = None) -> typing.Optional['AppTaskQL']:
+        tasks = await info.context.tasks(int(user_id))
 
         if task_id is not None:
             try:
@@ -81,29 +97,37 @@ class Query:
                 return None
 
     @strawberry.field
-    def count_planned_tasks(self, user_id: str) -> int:
-        return len(
-            [x for x in task_storage.fetch_tasks_with_subtasks(int(user_id)) if x.status == x.status.NOT_DEFINED])
+    async def count_planned_tasks(self, info: Info, user_id: str) -> int:
+        counts = await info.context.task_counts(int(user_id))
+        return counts[StatusEnum.NOT_DEFINED]
 
     @strawberry.field
-    def count_completed_tasks(self, user_id: str) -> int:
-        return len([x for x in task_storage.fetch_tasks_with_subtasks(int(user_id)) if x.status == x.status.COMPLETED])
+    async def count_completed_tasks(self, info: Info, user_id: str) -> int:
+        counts = await info.context.task_counts(int(user_id))
+        return counts[StatusEnum.COMPLETED]
 
     @strawberry.field
-    def notes(self, user_id: str) -> list['AppNoteQL']:
-        return note_storage.fetch_all_notes_for_user(int(user_id))
+    async def task_counters(self, info: Info, user_ids: list[str]) -> list['TaskCountersQL']:
+        # Counters of a whole fleet come from one grouped count statement
+        counts = await info.context.task_counts_loader.load_many([int(x) for x in user_ids])
+        return [TaskCountersQL.from_counts(user_id, x) for user_id, x in zip(user_ids, counts)]
 
     @strawberry.field
-    def subtask(self, user_id: str, subtask_id: str) -> typing.Optional['SubtaskQL']:
+    async def notes(self, user_id: str) -> list['AppNoteQL']:
+        return await async_note_storage.fetch_all_notes_for_user(int(user_id))
+
+    @strawberry.field
+    async def subtask(self, info: Info, user_id: str, subtask_id: str) -> typing.Optional['SubtaskQL']:
+        tasks = await info.context.tasks(int(user_id))
         try:
-            return next(s for t in task_storage.fetch_tasks_with_subtasks(int(user_id)) for s in t.subtasks if
-                        s.id == int(subtask_id))
+            return next(s for t in tasks for s in t.subtasks if s.id == int(subtask_id))
         except StopIteration:
             return None
 
     @strawberry.field
-    def subtasks(self, user_id: str) -> list['SubtaskQL']:
-        return [s for t in task_storage.fetch_tasks_with_subtasks(int(user_id)) for s in t.subtasks]
+    async def subtasks(self, info: Info, user_id: str) -> list['SubtaskQL']:
+        tasks = await info.context.tasks(int(user_id))
+        return [s for t in tasks for s in t.subtasks]
 
 
 @strawberry.experimental.pydantic.type(model=Location)
@@ -180,12 +204,58 @@ class AppTaskQL:
     route: 'AppRouteQL'
 
     @strawberry.field
-    def active_subtask(self) -> typing.Optional[SubtaskQL]:
-        try:
-            return next(x for x in self.subtasks if x.status == x.status.IN_PROGRESS)
-        except StopIteration:
-            return None
+    def cursor(self) -> str:
+        return task_cursor(self)
+
+    @strawberry.field
+    def active_subtask(self, info: Info) -> typing.Optional[SubtaskQL]:
+        return info.context.active_subtask(self)
+
+
+@strawberry.experimental.pydantic.type(model=DBTaskEvent)
+class TaskEventQL:
+    id: str
+    task_id: str
+    type: str
+    text: str
+    event_datetime: datetime
+
+
+@strawberry.type
+class TaskCountersQL:
+    user_id: str
+    planned: int
+    in_progress: int
+    completed: int
+    cancelled: int
+
+    @classmethod
+    def from_counts(cls, user_id: str, counts: dict[StatusEnum, int]) -> 'TaskCountersQL':
+        return cls(user_id=user_id, planned=counts[StatusEnum.NOT_DEFINED], in_progress=counts[StatusEnum.IN_PROGRESS],
+                   completed=counts[StatusEnum.COMPLETED], cancelled=counts[StatusEnum.CANCELLED])
+
+
+@strawberry.experimental.pydantic.type(model=DBTaskDelta)
+class TaskDeltaQL:
+    tasks: list[AppTaskQL]
+    events: list[TaskEventQL]
+    deleted_task_ids: list[str]
+    resync: bool
+    watermark: str
+
+
+def insert_event(values: dict[str, typing.Any]) -> APP_EVENT:
+    with base_storage.get_session() as session:
+        stmt = insert(MPAppEventDB).values(**values)
+        row = session.execute(stmt)
+        session.commit()
+        row = session.execute(text("""
+            select * from APP_EVENT where ID_APP_EVENT = :idx
+        """), {"idx": row.inserted_primary_key_rows[0][0]})
+        data = row.fetchone()
+    task_cache.invalidate(values["APP_EVENT_ID_SOTR"])
 
+    return row_mapper(APP_EVENT, tuple(row.keys()))(data)
 
 
 @strawberry.type
@@ -199,27 +269,20 @@ class Mutation:
     APP_EVENT_TEXT: str,
     APP_EVENT_DATA: str,
     APP_EVENT_DT: str) -> APP_EVENT:
-        with base_storage.get_session() as session:
-            stmt = insert(MPAppEventDB).values(
-                **{
-                    "APP_EVENT_ID_SOTR": int(APP_EVENT_ID_SOTR),
-                    "APP_EVENT_ID_REC": int(APP_EVENT_ID_REC),
-                    "APP_EVENT_VID": int(APP_EVENT_VID),
-                    "APP_EVENT_TIP": int(APP_EVENT_TIP),
-                    "APP_EVENT_TEXT": APP_EVENT_TEXT,
-                    "APP_EVENT_DATA": json.dumps(json.loads(APP_EVENT_DATA), separators=(',', ":")),
-                    "APP_EVENT_DT": datetime.fromtimestamp(int(APP_EVENT_DT) / 1000),
-                }
-            )
-            row = session.execute(stmt)
-            session.commit()
-            row = session.execute(text("""
-                select * from APP_EVENT where ID_APP_EVENT = :idx
-            """), {"idx": row.inserted_primary_key_rows[0][0]})
-            data = row.fetchone()
-
-        return APP_EVENT(**{row._metadata.keys._keys[idx].upper(): elem for idx, elem in enumerate(data) if
-                             row._metadata.keys._keys[idx].upper() in APP_EVENT.__annotations__})
-
-
-schema = strawberry.Schema(query=Query, mutation=Mutation)
+        return await run_in_storage_executor(insert_event, {
+            "APP_EVENT_ID_SOTR": int(APP_EVENT_ID_SOTR),
+            "APP_EVENT_ID_REC": int(APP_EVENT_ID_REC),
+            "APP_EVENT_VID": int(APP_EVENT_VID),
+            "APP_EVENT_TIP": int(APP_EVENT_TIP),
+            "APP_EVENT_TEXT": APP_EVENT_TEXT,
+            "APP_EVENT_DATA": json.dumps(json.loads(APP_EVENT_DATA), separators=(',', ":")),
+            "APP_EVENT_DT": datetime.fromtimestamp(int(APP_EVENT_DT) / 1000),
+        })
+
+
+# ValidationCache stores validation errors in the execution context, so it has to run before QueryCostLimiter
+schema = strawberry.Schema(query=Query, mutation=Mutation,
+                           extensions=[QueryDepthLimiter(max_depth=Config.graphql_max_depth),
+                                       ParserCache(maxsize=Config.graphql_document_cache_size),
+                                       ValidationCache(maxsize=Config.graphql_document_cache_size),
+                                       QueryCostLimiter])
@@ -8,7 +8,8 @@ from pydantic_extra_types.phone_numbers import PhoneNumber
 
 from core.config import Config
 from core.errors.auth.errors import profile_not_founded, incorrect_phone_number
-from core.storage import profile_storage
+from core.helpers.profile_helpers import profile_claims
+from core.storage import async_profile_storage, profile_cache, run_in_storage_executor
 
 router = APIRouter(prefix="/auth")
 
@@ -34,23 +35,25 @@ async def get_authorization_code(req: PhoneNumberRequest):
         if not 10 <= len(req.phoneNumber) <= 12:
             incorrect_phone_number()
 
-    p = profile_storage.get_profile_by_phone("".join(char for char in req.phoneNumber if char.isdigit()))
+    p = await async_profile_storage.get_profile_by_phone("".join(char for char in req.phoneNumber if char.isdigit()))
     if not p:
         profile_not_founded()
-    return {"code": profile_storage.generate_profile_auth_code(p.id, p.phone_number)}
+    return {"code": await async_profile_storage.generate_profile_auth_code(p.id, p.phone_number)}
 
 
 @router.post("/phone/code")
 async def get_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> Token:
-    p = profile_storage.get_profile_by_phone(''.join(char for char in form_data.username if char.isdigit()))
+    p = await async_profile_storage.get_profile_by_phone(''.join(char for char in form_data.username if char.isdigit()))
     if not p:
         profile_not_founded()
 
-    check = profile_storage.check_profile_code(p.id, form_data.password)
+    check = await async_profile_storage.check_profile_code(p.id, form_data.password)
     if not check:
         raise HTTPException(status_code=403, detail="Incorrect code")
 
-    token = jwt.encode({"profile_id": p.id, "exp": time.time() + 60 * 60 * 24}, algorithm="HS256", key=Config.secret)
+    # Signing in refreshes the cached profile
+    await run_in_storage_executor(profile_cache.invalidate, p.id)
+    token = jwt.encode({**profile_claims(p), "exp": time.time() + 60 * 60 * 24}, algorithm="HS256", key=Config.secret)
     return Token(access_token=token, token_type="bearer")
 
 
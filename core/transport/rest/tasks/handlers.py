@@ -1,16 +1,17 @@
-from typing import Union, Callable
-
-from fastapi import APIRouter, Depends, Path
+from fastapi import APIRouter, Depends, Path, Query, Response
 
 from core.errors.auth.errors import no_task_for_current_user
-from core.errors.task.errors import unavailable_status, should_provide_error_text_with_cancelled_status, \
-    update_task_by_chain_failed
+from core.helpers.etag_helpers import task_etag
+from core.helpers.pagination import MAX_PAGE_SIZE, page_size, set_next_cursor
+from core.helpers.serialization import json_response, tasks_adapter, task_adapter, subtask_adapter, \
+    subtasks_adapter, events_adapter, task_delta_adapter
 from core.helpers.profile_helpers import get_user_from_token
 from core.model.profile.db import ProfileDB
-from core.model.task.db import DBAppTask, DBSubTask, DBEvent
+from core.model.task.db import DBAppTask, DBSubTask, DBEvent, DBTaskDelta
 from core.model.task.enums import StatusEnum
-from core.model.task.requests import SetTaskStatusActiveRequest, SetSubtaskStatusRequest, UpdTaskRequest, UpdTaskData
-from core.storage import task_storage
+from core.model.task.requests import SetTaskStatusActiveRequest, SetSubtaskStatusRequest, UpdTaskRequest
+from core.service.task.validator import ChainValidator
+from core.storage import async_task_storage
 
 from core.model.task.db2 import MPAppTaskDB
 
@@ -22,133 +23,65 @@ router = APIRouter(prefix="/tasks", tags=["Tasks and subtasks"])
 #     return MPAppTaskDB.fetch_all()
 
 
-@router.get("", description="Fetch Task for authenticated user")
-async def get_tasks(user: ProfileDB = Depends(get_user_from_token)) -> list[DBAppTask]:
-    return task_storage.fetch_tasks_with_subtasks(user.id)
+@router.get("", description="Fetch Task for authenticated user. Paged when `limit` or `cursor` is given, "
+                            "the next page cursor is returned in the X-Next-Cursor header",
+            dependencies=[Depends(task_etag)])
+async def get_tasks(response: Response, user: ProfileDB = Depends(get_user_from_token),
+                    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: str | None = Query(None)) -> list[DBAppTask]:
+    if limit is None and cursor is None:
+        return json_response(tasks_adapter, await async_task_storage.fetch_tasks_with_subtasks(user.id), response)
+
+    tasks, next_cursor = await async_task_storage.fetch_tasks_page(user.id, page_size(limit), cursor)
+    set_next_cursor(response, next_cursor)
+    return json_response(tasks_adapter, tasks, response)
 
 
 @router.post("")
 async def upd_task(req: UpdTaskRequest, user: ProfileDB = Depends(get_user_from_token)) -> list[DBAppTask]:
-    def check_task_in_progress(e: UpdTaskData, t: DBAppTask):
-        t.subtasks.sort(key=lambda u: u.start_pln)
-        try:
-            next(x for x in req.data if x.status == StatusEnum.IN_PROGRESS and x.task_id == t.subtasks[0].id)
-        except StopIteration:
-            raise Exception("Chain Failed")
-
-    def check_task_completed(e: UpdTaskData, t: DBAppTask):
-        t.subtasks.sort(key=lambda u: u.start_pln)
-        try:
-            next(x for x in req.data if x.status == StatusEnum.COMPLETED and x.task_id == t.subtasks[-1].id)
-        except StopIteration:
-            raise Exception("Chain Failed")
-
-    def check_sbt_in_progress(e: UpdTaskData, sbt: DBSubTask):
-        main_task = next(t for t in tasks for s in t.subtasks if s.id == sbt.id)
-        main_task.subtasks.sort(key=lambda u: u.start_pln)
-        try:
-            if sbt.id == main_task.subtasks[0].id:
-                next(x for x in req.data if x.status == StatusEnum.IN_PROGRESS and x.task_id == main_task.id)
-            else:
-                prev_idx = main_task.subtasks.index(sbt) - 1
-                next(ev for ev in req.data if ev.task_id == main_task.subtasks[prev_idx].id and ev.status in (
-                StatusEnum.COMPLETED, StatusEnum.CANCELLED))
-        except StopIteration as exc:
-            update_task_by_chain_failed(exc)
-
-    def check_sbt_completed(e: UpdTaskData, sbt: DBSubTask):
-        main_task = next(t for t in tasks for s in t.subtasks if s.id == sbt.id)
-        main_task.subtasks.sort(key=lambda u: u.start_pln)
-
-        try:
-            if sbt.id == main_task.subtasks[-1].id:
-                next(ev for ev in req.data if ev.task_id == main_task.id and ev.status == StatusEnum.COMPLETED)
-            else:
-                next_idx = main_task.subtasks.index(sbt) + 1
-                next(ev for ev in req.data if
-                     ev.task_id == main_task.subtasks[next_idx].id and ev.status == StatusEnum.IN_PROGRESS)
-        except StopIteration as exc:
-            update_task_by_chain_failed(exc)
-
-    steps: dict[Union[type[DBAppTask], type[DBSubTask]], dict[
-        StatusEnum, Callable[[UpdTaskData, Union[DBAppTask, DBSubTask]], None]]] = {
-        DBAppTask: {
-            StatusEnum.IN_PROGRESS: check_task_in_progress,
-            StatusEnum.COMPLETED: check_task_completed,
-        },
-        DBSubTask: {
-            StatusEnum.COMPLETED: check_sbt_completed,
-            StatusEnum.CANCELLED: check_sbt_completed,
-            StatusEnum.IN_PROGRESS: check_sbt_in_progress,
-        }
-    }
-
-    tasks = task_storage.fetch_tasks_with_subtasks(user.id)
-    available_tasks_ids = [x.id for x in tasks] + [sbt.id for t in tasks for sbt in t.subtasks]
-
-    req.data.sort(key=lambda u: u.dt)
-    if len(req.data) <= 1 and len(req.data) % 2 != 0:
-        raise Exception("should provide the pairs of arguments")
-
-    for idx, event in enumerate(req.data):
-        # Сделать проверку, как только заканчивается событие с этим же временем должно начинаться новое
-        #  т.е. Нельзя передать только начало события или только конец
-        #  Если передаем InProgress и идентификатор является задачей - должны передать InProgress для подзадачи
-        #  Если передаем InProgress и идентификатор является подзадачей - должны передать Completed или Canceled
-        #  для подзадачи
-
-        # Цепочка имеет валидна, если имеет след вид:
-        #  task (InProgress) -> subtask (InProgress);
-        #   subtask(Completed/Cancelled) -> subtask(InProgress);
-        #   subtask(Completed/Cancelled) -> task(Completed)
-
-        # НЕОБХОДИМО ДЕЛАТЬ И ОБРАТНУЮ ПРОВЕРКУ
-        #   если sbt(InProgress), то должно существовать task(InProgress) или sbt(Completed/Cancelled)
-        #   если task(Completed), то последняя подзадача sbt по APP_TASK_DT_START_PLN должна быть передана
-
-        if event.task_id not in available_tasks_ids:
-            no_task_for_current_user()
-        if event.status == StatusEnum.NOT_DEFINED:
-            unavailable_status()
-        if event.status == StatusEnum.CANCELLED and (event.error_text is None or event.error_text.strip() == ''):
-            should_provide_error_text_with_cancelled_status()
+    validator = ChainValidator(await async_task_storage.fetch_tasks_with_subtasks(user.id))
+    events = validator.validate(req.data)
 
-        # проверяем является ли событие подзадачей
-        is_sbt = event.task_id not in (x.id for x in tasks)
-        task_: DBAppTask | DBSubTask = next(x for x in tasks if x.id == event.task_id) if not is_sbt else next(
-            sbt for x in tasks for sbt in x.subtasks if sbt.id == event.task_id)
+    await async_task_storage.update_tasks(events, user.id, root_task_ids=validator.root_task_ids)
+    return json_response(tasks_adapter, await async_task_storage.fetch_tasks_with_subtasks(user.id))
 
-        try:
-            steps[type(task_)][event.status](event, task_)
-        except KeyError as exc:
-            update_task_by_chain_failed(exc)
 
-    [task_storage.update_task(event, user.id) for event in req.data]
-    return task_storage.fetch_tasks_with_subtasks(user.id)
+@router.get("/delta", description="Tasks, subtasks and events changed since the `since` watermark. Without it the "
+                                  "whole tree is returned; pass the returned watermark to the next call. Rows close "
+                                  "to the watermark are returned again, so merge tasks and events by id. Param changes "
+                                  "and edited or deleted events are not tracked: the whole tree is returned again "
+                                  "periodically with `resync` set, and then replaces the client's copy")
+async def get_tasks_delta(user: ProfileDB = Depends(get_user_from_token),
+                          since: str | None = Query(None)) -> DBTaskDelta:
+    return json_response(task_delta_adapter, await async_task_storage.fetch_tasks_delta(user.id, since))
 
 
-@router.get("/planned")
-async def get_planned_tasks(user: ProfileDB = Depends(get_user_from_token)) -> list[DBAppTask]:
-    # TODO Rebuild this method to fetch only planned tasks
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
-    return [x for x in tasks if x.status == StatusEnum.NOT_DEFINED]
+@router.get("/planned", dependencies=[Depends(task_etag)])
+async def get_planned_tasks(response: Response, user: ProfileDB = Depends(get_user_from_token)) -> list[DBAppTask]:
+    tasks = await async_task_storage.fetch_tasks_by_status(user.id, StatusEnum.NOT_DEFINED)
+    return json_response(tasks_adapter, tasks, response)
 
 
-@router.get("/active")
-async def get_active_task(user: ProfileDB = Depends(get_user_from_token)) -> DBAppTask | dict:
-    # TODO Rebuild this method to fetch only active tasks
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
-    try:
-        return next(x for x in tasks if x.status == StatusEnum.IN_PROGRESS)
-    except StopIteration:
+@router.get("/active", dependencies=[Depends(task_etag)])
+async def get_active_task(response: Response, user: ProfileDB = Depends(get_user_from_token)) -> DBAppTask | dict:
+    tasks = await async_task_storage.fetch_tasks_by_status(user.id, StatusEnum.IN_PROGRESS)
+    if not tasks:
         return {}
+    return json_response(task_adapter, tasks[0], response)
+
 
+@router.get("/completed", dependencies=[Depends(task_etag)])
+async def get_completed_tasks(response: Response, user: ProfileDB = Depends(get_user_from_token),
+                              limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                              cursor: str | None = Query(None)) -> list[DBAppTask]:
+    if limit is None and cursor is None:
+        tasks = await async_task_storage.fetch_tasks_by_status(user.id, StatusEnum.COMPLETED)
+        return json_response(tasks_adapter, tasks, response)
 
-@router.get("/completed")
-async def get_active_task(user: ProfileDB = Depends(get_user_from_token)) -> list[DBAppTask]:
-    # TODO Rebuild this method to fetch only active tasks
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
-    return [x for x in tasks if x.status == StatusEnum.COMPLETED]
+    tasks, next_cursor = await async_task_storage.fetch_tasks_page(user.id, page_size(limit), cursor,
+                                                                   status=StatusEnum.COMPLETED)
+    set_next_cursor(response, next_cursor)
+    return json_response(tasks_adapter, tasks, response)
 
 
 # @router.post('/active')
@@ -167,38 +100,44 @@ async def get_active_task(user: ProfileDB = Depends(get_user_from_token)) -> lis
 #     no_task_for_current_user()
 
 
-@router.get("/{task_id}/subtasks")
-async def get_subtasks(user: ProfileDB = Depends(get_user_from_token), task_id: int = Path()) -> list[DBSubTask]:
-    # TODO Rebuild this method to fetch only subtasks
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
-    try:
-        t = next(x for x in tasks if x.id == task_id)
-        return t.subtasks
-    except StopIteration:
+@router.get("/{task_id}/subtasks", dependencies=[Depends(task_etag)])
+async def get_subtasks(response: Response, user: ProfileDB = Depends(get_user_from_token),
+                       task_id: int = Path()) -> list[DBSubTask]:
+    task = await async_task_storage.fetch_user_task(user.id, task_id, with_events=False)
+    if task is None:
         no_task_for_current_user()
+    return json_response(subtasks_adapter, task.subtasks, response)
 
 
 @router.post("/subtask")
 async def set_status_to_subtask(req_data: SetSubtaskStatusRequest,
                                 user: ProfileDB = Depends(get_user_from_token)) -> DBSubTask:
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
+    tasks = await async_task_storage.fetch_tasks_with_subtasks(user_id=user.id)
     try:
         subtask = next(subtask for t in tasks for subtask in t.subtasks if subtask.id == req_data.subtask_id)
 
-        task_storage.set_subtask_to_completed(subtask_id=subtask.id, profile_id=user.id, dt=req_data.finished_dt)
+        await async_task_storage.set_subtask_to_completed(subtask_id=subtask.id, profile_id=user.id,
+                                                          dt=req_data.finished_dt)
         subtask.status = StatusEnum.COMPLETED
-        return subtask
+        return json_response(subtask_adapter, subtask)
 
     except StopIteration:
         no_task_for_current_user()
 
 
-@router.get("/{task_id}/events")
-async def get_events(user: ProfileDB = Depends(get_user_from_token), task_id: int = Path()) -> list[DBEvent]:
-    # TODO Rebuild this method to fetch only events
-    tasks = task_storage.fetch_tasks_with_subtasks(user_id=user.id)
-    try:
-        t = next(x for x in tasks if x.id == task_id)
-        return [x for x in t.events if x.type == "Change"]
-    except StopIteration:
+@router.get("/{task_id}/events", dependencies=[Depends(task_etag)])
+async def get_events(response: Response, user: ProfileDB = Depends(get_user_from_token), task_id: int = Path(),
+                     limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                     cursor: str | None = Query(None)) -> list[DBEvent]:
+    if limit is None and cursor is None:
+        events = await async_task_storage.fetch_task_events(user.id, task_id, event_type="Change")
+        if events is None:
+            no_task_for_current_user()
+        return json_response(events_adapter, events, response)
+
+    page = await async_task_storage.fetch_task_events_page(user.id, task_id, "Change", page_size(limit), cursor)
+    if page is None:
         no_task_for_current_user()
+    events, next_cursor = page
+    set_next_cursor(response, next_cursor)
+    return json_response(events_adapter, events, response)
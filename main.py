@@ -1,10 +1,33 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
 
 from core.transport.rest import router
 from core.transport.graphql import graphql_router
 from core.errors.base import MPDriverException
-app = FastAPI()
+from core.config import Config
+from core.helpers.dictionary_upload_redis import upload_dictionaries_to_redis
+from core.storage import task_cache, profile_cache, dictionary_storage
+from core.storage.async_storage import storage_executor, cache_executor
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    dictionary_storage.start_refresh(Config.dictionary_refresh_interval,
+                                     on_refresh=upload_dictionaries_to_redis if Config.dictionary_redis_mirror else None)
+    task_cache.start_listener()
+    profile_cache.start_listener()
+    yield
+    profile_cache.stop_listener()
+    task_cache.stop_listener()
+    dictionary_storage.stop_refresh()
+    storage_executor.shutdown(wait=False, cancel_futures=True)
+    cache_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(router)
 app.include_router(graphql_router, prefix="/graphql")
 
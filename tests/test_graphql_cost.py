@@ -0,0 +1,59 @@
+import unittest
+
+from graphql import parse, OperationDefinitionNode
+
+from core.config import Config
+from core.transport.graphql.cost import operation_cost
+from core.transport.graphql.schema import schema
+
+DASHBOARD = """{
+  tasks(userId: "31") {
+    id status text startPln
+    events { id type text eventDatetime }
+    subtasks { id status text station { name location { lat lon } } }
+    route { name truck { gost } trailer { gost } }
+    activeSubtask { id }
+  }
+  countPlannedTasks(userId: "31")
+  countCompletedTasks(userId: "31")
+}"""
+
+
+def cost(query: str, variables: dict | None = None) -> int:
+    document = parse(query)
+    operation = next(x for x in document.definitions if isinstance(x, OperationDefinitionNode))
+    return operation_cost(schema._schema, operation, {}, variables)
+
+
+def fan_out(count: int, field: str = "tasks") -> str:
+    return "{ " + " ".join(f'a{i}: {field}(userId: "{i}") {{ id }}' for i in range(count)) + " }"
+
+
+class QueryCostTest(unittest.TestCase):
+    def test_single_user_query_is_accepted(self):
+        self.assertLessEqual(cost(DASHBOARD), Config.graphql_max_cost)
+
+    def test_fan_out_over_users_is_rejected(self):
+        self.assertGreater(cost(fan_out(50)), Config.graphql_max_cost)
+
+        result = schema.execute_sync(fan_out(50))
+        self.assertIsNone(result.data)
+        self.assertIn("exceeds the maximum cost", result.errors[0].message)
+
+    def test_fan_out_over_mixed_task_fields_is_rejected(self):
+        query = "{ " + " ".join(f'a{i}: subtasks(userId: "{i}") {{ id }} b{i}: task(userId: "{i}") {{ id }}'
+                                for i in range(10)) + " }"
+        self.assertGreater(cost(query), Config.graphql_max_cost)
+
+    def test_snapshot_is_charged_once_per_user(self):
+        once = cost('{ tasks(userId: "31") { id } }')
+        shared = cost('{ a: tasks(userId: "31") { id } b: subtasks(userId: "31") { id } }')
+        self.assertLess(shared, once * 2)
+
+    def test_arguments_from_variables(self):
+        query = 'query Q($a: String!, $b: String!) { a: tasks(userId: $a) { id } b: tasks(userId: $b) { id } }'
+        self.assertLess(cost(query, {"a": "1", "b": "1"}), cost(query, {"a": "1", "b": "2"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+
+from core.database.pool import PoolManager, PoolTimeout, PoolClosed
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    def ping(self):
+        if not self.alive:
+            raise ConnectionError("connection lost")
+
+
+class FakeFactory:
+    def __init__(self):
+        self.connections: list[FakeConnection] = []
+
+    def __call__(self) -> FakeConnection:
+        con = FakeConnection()
+        self.connections.append(con)
+        return con
+
+
+class PoolManagerTest(unittest.TestCase):
+    def make_pool(self, **kwargs) -> PoolManager:
+        self.factory = FakeFactory()
+        kwargs.setdefault("probe_interval", None)
+        pool = PoolManager(self.factory, **kwargs)
+        self.addCleanup(pool.close, timeout=0)
+        return pool
+
+    def test_acquire_timeout(self):
+        pool = self.make_pool(max_connections=1)
+        pool.connect()
+
+        started = time.monotonic()
+        with self.assertRaises(PoolTimeout):
+            pool.connect(timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(pool.stats().timeouts, 1)
+        self.assertEqual(len(self.factory.connections), 1)
+
+    def test_waiter_is_woken_by_release(self):
+        pool = self.make_pool(max_connections=1)
+        con = pool.connect()
+        acquired = []
+
+        waiter = threading.Thread(target=lambda: acquired.append(pool.connect(timeout=5)))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(pool.stats().waiting, 1)
+
+        started = time.monotonic()
+        con.close()
+        waiter.join(1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(acquired, [con])
+        self.assertEqual(pool.stats().timeouts, 0)
+
+    def test_max_lifetime(self):
+        pool = self.make_pool(max_lifetime=0.05)
+        pool.connect().close()
+        time.sleep(0.1)
+
+        con = pool.connect()
+        self.assertEqual(len(self.factory.connections), 2)
+        self.assertTrue(self.factory.connections[0].closed)
+        self.assertIs(con._connection, self.factory.connections[1])
+        self.assertEqual(pool.stats().discarded, 1)
+
+    def test_idle_timeout_without_probe(self):
+        pool = self.make_pool(idle_timeout=0.05)
+        pool.connect().close()
+        time.sleep(0.1)
+
+        con = pool.connect()
+        self.assertTrue(self.factory.connections[0].closed)
+        self.assertIs(con._connection, self.factory.connections[1])
+
+    def test_probe_drops_dead_and_idle_connections(self):
+        pool = self.make_pool(idle_timeout=0.1)
+        first, second, third = pool.connect(), pool.connect(), pool.connect()
+        first.close()
+        time.sleep(0.15)
+        second.close()
+        third.close()
+        self.factory.connections[1].alive = False
+
+        pool.probe()
+
+        self.assertEqual([x.closed for x in self.factory.connections], [True, True, False])
+        stats = pool.stats()
+        self.assertEqual((stats.size, stats.idle, stats.discarded), (1, 1, 2))
+        self.assertIs(pool.connect(), third)
+
+    def test_close_drains_connections_in_use(self):
+        pool = self.make_pool()
+        con = pool.connect()
+        pool.connect().close()
+
+        closer = threading.Thread(target=pool.close, kwargs={"timeout": 5})
+        closer.start()
+        time.sleep(0.05)
+        self.assertTrue(closer.is_alive())
+        self.assertFalse(self.factory.connections[0].closed)
+        with self.assertRaises(PoolClosed):
+            pool.connect()
+
+        con.close()
+        closer.join(1)
+        self.assertFalse(closer.is_alive())
+        self.assertTrue(all(x.closed for x in self.factory.connections))
+        self.assertEqual(pool.stats().size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()